@@ -0,0 +1,32 @@
+"""index enrollment access paths
+
+Revision ID: 1741774b1ab8
+Revises: d5406d1a9811
+Create Date: 2026-10-18 09:12:44.519203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1741774b1ab8'
+down_revision = 'd5406d1a9811'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('enrollment', schema=None) as batch_op:
+        batch_op.create_index('ix_enrollment_inep_year_roll', ['inep', 'year', 'roll'], unique=False)
+        batch_op.create_index('ix_enrollment_taxnr_year', ['taxnr', 'year'], unique=False)
+        batch_op.create_index('ix_enrollment_year_gift', ['year', 'gift'], unique=False)
+        batch_op.create_index('ix_enrollment_cpfnr_year', ['cpfnr', 'year'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('enrollment', schema=None) as batch_op:
+        batch_op.drop_index('ix_enrollment_cpfnr_year')
+        batch_op.drop_index('ix_enrollment_year_gift')
+        batch_op.drop_index('ix_enrollment_taxnr_year')
+        batch_op.drop_index('ix_enrollment_inep_year_roll')
@@ -0,0 +1,47 @@
+"""add student history
+
+Revision ID: 2c47d9ad9c20
+Revises: 77004550576f
+Create Date: 2026-10-18 17:10:49.965704
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c47d9ad9c20'
+down_revision = '77004550576f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('history',
+    sa.Column('cpfnr', sa.String(length=11), nullable=False),
+    sa.Column('editions', sa.Integer(), nullable=False),
+    sa.Column('medals', sa.Integer(), nullable=False),
+    sa.Column('year', sa.String(length=4), nullable=False),
+    sa.Column('inep', sa.String(length=8), nullable=False),
+    sa.Column('roll', sa.Integer(), nullable=False),
+    sa.Column('gift', sa.CHAR(), nullable=False),
+    sa.ForeignKeyConstraint(['cpfnr'], ['student.cpfnr'], onupdate='CASCADE', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('cpfnr')
+    )
+    # the latest edition of every student; should a student have two
+    # enrollments in it, the one with the smallest (inep, taxnr) is taken
+    # whole, as refresh_histories does
+    op.execute(
+        "INSERT INTO history "
+        "(cpfnr, editions, medals, year, inep, roll, gift) "
+        "SELECT s.cpfnr, s.editions, s.medals, e.year, e.inep, e.roll, e.gift "
+        "FROM (SELECT cpfnr, COUNT(DISTINCT year) AS editions, "
+        "SUM(CASE WHEN gift IN ('O', 'P', 'B') THEN 1 ELSE 0 END) AS medals "
+        "FROM enrollment GROUP BY cpfnr) AS s "
+        "JOIN (SELECT cpfnr, year, inep, roll, gift, ROW_NUMBER() OVER "
+        "(PARTITION BY cpfnr ORDER BY year DESC, inep, taxnr) AS n "
+        "FROM enrollment) AS e ON e.cpfnr = s.cpfnr AND e.n = 1"
+    )
+
+def downgrade():
+    op.drop_table('history')
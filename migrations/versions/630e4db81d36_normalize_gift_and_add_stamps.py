@@ -0,0 +1,30 @@
+"""normalize gift and add stamps
+
+Revision ID: 630e4db81d36
+Revises: 1741774b1ab8
+Create Date: 2026-10-18 10:03:17.842106
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '630e4db81d36'
+down_revision = '1741774b1ab8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    stamp = op.create_table('stamp',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(stamp, [{'name': 'medalists', 'version': 0}])
+    op.execute("UPDATE enrollment SET gift = UPPER(gift)")
+
+
+def downgrade():
+    op.drop_table('stamp')
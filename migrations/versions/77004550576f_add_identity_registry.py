@@ -0,0 +1,36 @@
+"""add identity registry
+
+Revision ID: 77004550576f
+Revises: c724f331a8d4
+Create Date: 2026-10-18 15:21:40.117254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '77004550576f'
+down_revision = 'c724f331a8d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('identity',
+    sa.Column('kind', sa.String(length=5), nullable=False),
+    sa.Column('value', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'value')
+    )
+    # UNION drops the values professors and students already share
+    op.execute(
+        "INSERT INTO identity (kind, value) "
+        "SELECT 'cpf', taxnr FROM professor "
+        "UNION SELECT 'cpf', cpfnr FROM student "
+        "UNION SELECT 'email', email FROM professor "
+        "UNION SELECT 'email', email FROM student"
+    )
+
+
+def downgrade():
+    op.drop_table('identity')
@@ -0,0 +1,33 @@
+"""add spent tokens
+
+Revision ID: c724f331a8d4
+Revises: ec51bb4c29fe
+Create Date: 2026-10-18 14:02:11.981346
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c724f331a8d4'
+down_revision = 'ec51bb4c29fe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('spent_token',
+    sa.Column('jti', sa.String(length=32), nullable=False),
+    sa.Column('expires', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    with op.batch_alter_table('spent_token', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_spent_token_expires'), ['expires'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('spent_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_spent_token_expires'))
+
+    op.drop_table('spent_token')
@@ -0,0 +1,35 @@
+"""add email campaigns
+
+Revision ID: ec51bb4c29fe
+Revises: 27d4bb0b139f
+Create Date: 2026-10-18 13:14:36.270518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ec51bb4c29fe'
+down_revision = '27d4bb0b139f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('campaign',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('text_body', sa.Text(), nullable=False),
+    sa.Column('html_body', sa.Text(), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('cursor', sa.String(length=11), nullable=False),
+    sa.Column('sent', sa.Integer(), nullable=False),
+    sa.Column('failed', sa.Integer(), nullable=False),
+    sa.Column('finished', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('campaign')
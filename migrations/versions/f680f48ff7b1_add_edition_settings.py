@@ -0,0 +1,42 @@
+"""add edition settings
+
+Revision ID: f680f48ff7b1
+Revises: 630e4db81d36
+Create Date: 2026-10-18 11:42:05.318274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f680f48ff7b1'
+down_revision = '630e4db81d36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    edition = op.create_table('edition',
+    sa.Column('year', sa.String(length=4), nullable=False),
+    sa.Column('quota', sa.Integer(), nullable=False),
+    sa.Column('opening', sa.String(length=8), nullable=False),
+    sa.Column('closing', sa.String(length=8), nullable=False),
+    sa.Column('step1', sa.String(length=8), nullable=False),
+    sa.Column('step2', sa.String(length=8), nullable=False),
+    sa.PrimaryKeyConstraint('year')
+    )
+    op.bulk_insert(edition, [{
+        'year': '2024',
+        'quota': 10,
+        'opening': '20240615',
+        'closing': '20240715',
+        'step1': '20240914',
+        'step2': '20241005',
+    }])
+    op.execute("INSERT INTO stamp (name, version) VALUES ('edition', 0)")
+
+
+def downgrade():
+    op.execute("DELETE FROM stamp WHERE name = 'edition'")
+    op.drop_table('edition')
@@ -1,4 +1,3 @@
-import sqlalchemy as sa
 from flask_wtf import FlaskForm
 from wtforms import PasswordField, StringField, SubmitField
 from wtforms.validators import (
@@ -9,9 +8,8 @@ from wtforms.validators import (
     ValidationError,
 )
 
-from omeg.conf.boost import db
 from omeg.data.load import CPF
-from omeg.mold.models import Professor
+from omeg.mold.models import Identity
 
 
 class professor_registration_request_form(FlaskForm):
@@ -77,19 +75,13 @@ class professor_registration_form(FlaskForm):
     submit = SubmitField("Registrar-se")
 
     def validate_taxnr(self, taxnr):
-        professor = db.session.scalar(
-            sa.select(Professor).where(Professor.taxnr == taxnr.data)
-        )
         if CPF(taxnr.data).digits_match() is False:
             raise ValidationError("CPF inconsistente")
-        elif professor is not None:
+        elif Identity.is_taken("cpf", CPF(taxnr.data).strfmt("raw")):
             raise ValidationError("CPF já existe em nosso banco de dados")
 
-    def validate_mail(self, email):
-        professor = db.session.scalar(
-            sa.select(Professor).where(Professor.email == email.data)
-        )
-        if professor is not None:
+    def validate_email(self, email):
+        if Identity.is_taken("email", email.data):
             raise ValidationError("Email já cadastrado")
 
 
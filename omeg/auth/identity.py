@@ -0,0 +1,84 @@
+from functools import wraps
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app, redirect, url_for
+from flask_login import UserMixin, current_user, login_required
+
+from omeg.conf.boost import db
+from omeg.conf.cache import TTLCache
+from omeg.mold.models import Professor
+
+# the professor behind each login, kept by every worker so that a request
+# needs no query to know who is logged in; an entry is dropped as soon as
+# this worker commits a change to the professor, and the ttl bounds how long
+# the other workers may keep the old name and email
+identity_cache = TTLCache(ttl=300, maxsize=4096)
+
+
+class Snapshot(UserMixin):
+    # what a request needs to know about the professor logged in; views that
+    # change the professor load the row itself
+    def __init__(self, taxnr, fname, email):
+        self.taxnr = taxnr
+        self.fname = fname
+        self.email = email
+
+    def get_id(self):
+        return self.taxnr
+
+    def __repr__(self):
+        return f"Snapshot {self.taxnr}"
+
+
+@sa.event.listens_for(so.Session, "after_flush")
+def collect_professor_changes(session, flush_context):
+    changed = session.info.setdefault("identities", set())
+    for obj in [*session.dirty, *session.deleted]:
+        if isinstance(obj, Professor):
+            changed.add(obj.taxnr)
+
+
+@sa.event.listens_for(so.Session, "after_commit")
+def forget_changed_identities(session):
+    for taxnr in session.info.pop("identities", set()):
+        identity_cache.pop(taxnr)
+
+
+@sa.event.listens_for(so.Session, "after_rollback")
+def discard_changed_identities(session):
+    session.info.pop("identities", None)
+
+
+def load_identity(taxnr):
+    snapshot = identity_cache.get(taxnr)
+    if snapshot is None:
+        row = db.session.execute(
+            sa.select(Professor.taxnr, Professor.fname, Professor.email).where(
+                Professor.taxnr == taxnr
+            )
+        ).first()
+        if row is None:
+            return None
+        snapshot = identity_cache.set(taxnr, Snapshot(*row))
+    stats = identity_cache.stats()
+    if (stats["hits"] + stats["misses"]) % 1000 == 0:
+        # the counters live in each worker, so each worker logs its own
+        current_app.logger.info(f"identity cache: {stats}")
+    return snapshot
+
+
+def professor_required(view):
+    # login_required, and the taxnr in the url must be the one of the
+    # professor logged in; the view is given that professor, as loaded by
+    # load_identity, instead of querying for it again
+    @wraps(view)
+    @login_required
+    def authorized_view(taxnr, **kwargs):
+        if taxnr != current_user.taxnr:
+            return redirect(url_for("bp_home_routes.home"))
+        return view(
+            taxnr=taxnr, professor=current_user._get_current_object(), **kwargs
+        )
+
+    return authorized_view
@@ -16,8 +16,9 @@ from omeg.auth.forms import (
     reset_password_request_form,
 )
 from omeg.conf.boost import db
+from omeg.conf.tokens import spend
 from omeg.data.load import CPF, payload
-from omeg.mold.models import Professor
+from omeg.mold.models import Identity, Professor
 
 bp_auth_routes = Blueprint("bp_auth_routes", __name__)
 
@@ -40,6 +41,7 @@ def request_registration():
         )
         if not professor:
             send_registration_request_email(form.email.data)
+            db.session.commit()
         return redirect(url_for("bp_home_routes.home"))
     return render_template(
         "auth/registration/request/page.html",
@@ -60,6 +62,8 @@ def registration(token):
             )
         )
     email = Professor.verify_registration_request_token(token)
+    if not email:
+        return redirect(url_for("bp_home_routes.home"))
     form = professor_registration_form(email=email)
     if form.validate_on_submit():
         professor = Professor(
@@ -69,8 +73,23 @@ def registration(token):
         )
         professor.set_password(form.password1.data)
         db.session.add(professor)
-        db.session.commit()
-        return redirect(url_for("bp_auth_routes.login"))
+        spend(token)
+        try:
+            db.session.commit()
+        except sa.exc.IntegrityError:
+            # the CPF or the email was taken, or the token was used, by
+            # another request in the meantime
+            db.session.rollback()
+            if Identity.is_taken("cpf", CPF(form.taxnr.data).strfmt("raw")):
+                form.taxnr.errors.append(
+                    "CPF já existe em nosso banco de dados"
+                )
+            elif Identity.is_taken("email", form.email.data):
+                form.email.errors.append("Email já cadastrado")
+            else:
+                return redirect(url_for("bp_home_routes.home"))
+        else:
+            return redirect(url_for("bp_auth_routes.login"))
     return render_template(
         "auth/registration/professor.html",
         edition=payload["edition"],
@@ -96,6 +115,7 @@ def request_password_reset():
         )
         if professor:
             send_password_reset_email(professor)
+            db.session.commit()
         return redirect(url_for("bp_home_routes.home"))
     return render_template(
         "auth/password/request/page.html",
@@ -121,7 +141,13 @@ def password_reset(token):
     form = reset_password_form()
     if form.validate_on_submit():
         professor.set_password(form.password1.data)
-        db.session.commit()
+        spend(token)
+        try:
+            db.session.commit()
+        except sa.exc.IntegrityError:
+            # the token was used by another request in the meantime
+            db.session.rollback()
+            return redirect(url_for("bp_home_routes.home"))
         return redirect(url_for("bp_auth_routes.login"))
     return render_template(
         "auth/password/reset.html",
@@ -151,6 +177,10 @@ def login():
             if professor.check_password(form.password.data) is False:
                 return redirect(url_for("bp_auth_routes.login"))
             else:
+                if professor.password_is_outdated():
+                    # rehashed with the current PASSWORD_METHOD
+                    professor.set_password(form.password.data)
+                    db.session.commit()
                 login_user(professor)
                 return redirect(
                     url_for(
@@ -1,26 +1,30 @@
-from threading import Thread
-
-from flask import current_app
 from flask_login import LoginManager
-from flask_mail import Mail, Message
+from flask_mail import Mail
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
+from omeg.conf.hashing import PasswordPool
+from omeg.conf.mailer import MailPool
+
 db = SQLAlchemy()
 login_manager = LoginManager()
 migrate = Migrate()
 mail = Mail()
-
-
-def send_async_email(omeg, msg):
-    with omeg.app_context():
-        mail.send(msg)
+mailpool = MailPool(mail)
+passwords = PasswordPool()
 
 
 def send_email(subject, sender, recipients, text_body, html_body):
-    msg = Message(subject, sender=sender, recipients=recipients)
-    msg.body = text_body
-    msg.html = html_body
-    Thread(
-        target=send_async_email, args=(current_app._get_current_object(), msg)
-    ).start()
+    # the email joins the caller's transaction and goes out once that is
+    # committed, see `flask data outbox`
+    from omeg.mold.models import Outbox
+
+    db.session.add(
+        Outbox(
+            subject=subject,
+            sender=sender,
+            recipients=",".join(recipients),
+            text_body=text_body,
+            html_body=html_body,
+        )
+    )
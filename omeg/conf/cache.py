@@ -0,0 +1,100 @@
+from threading import Lock
+from time import monotonic
+
+import sqlalchemy as sa
+
+from omeg.conf.boost import db
+
+
+class TTLCache:
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.store = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.store.get(key)
+            if item is not None and item[0] > monotonic():
+                self.hits += 1
+                return item[1]
+            self.store.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            if key not in self.store and len(self.store) >= self.maxsize:
+                self.store.pop(next(iter(self.store)))
+            expires = monotonic() + (self.ttl if ttl is None else ttl)
+            self.store[key] = (expires, value)
+        return value
+
+    def pop(self, key):
+        with self.lock:
+            self.store.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.store),
+            }
+
+
+class StampedCache:
+    # a per-worker cache that is emptied whenever the version stamp called
+    # `name` is bumped by any process; the stamp is read at most once every
+    # `poll` seconds, so lookups cost no round trip in between
+    def __init__(self, name, poll=5):
+        self.name = name
+        self.poll = poll
+        self.store = {}
+        self.lock = Lock()
+        self.version = None
+        self.checked = None
+
+    def sync(self):
+        now = monotonic()
+        if self.checked is not None and now - self.checked < self.poll:
+            return
+        from omeg.mold.models import Stamp
+
+        version = db.session.scalar(
+            sa.select(Stamp.version).where(Stamp.name == self.name)
+        )
+        with self.lock:
+            if version != self.version:
+                self.store.clear()
+                self.version = version
+            self.checked = now
+
+    def get(self, key):
+        self.sync()
+        with self.lock:
+            return self.store.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self.store[key] = value
+        return value
+
+
+def bump(name):
+    # joins the caller's transaction, so that the new version is published
+    # together with the change it stands for
+    from omeg.mold.models import Stamp
+
+    stamp = db.session.get(Stamp, name, with_for_update=True)
+    if stamp is None:
+        db.session.add(Stamp(name=name, version=1))
+    else:
+        stamp.version += 1
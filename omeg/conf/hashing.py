@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordPool:
+    # password hashes are worked out in a few processes of their own, so
+    # that a burst of logins takes CPU from them rather than from the
+    # threads rendering pages; at most `queue` hashes wait at a time and
+    # further callers block until one of them is done
+    def __init__(self):
+        self.lock = Lock()
+        self.pid = None
+        self.executor = None
+        self.prefix = None
+        self.calls = 0
+        self.seconds = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.method = app.config.get("PASSWORD_METHOD", "scrypt")
+        self.workers = app.config.get("PASSWORD_WORKERS", 2)
+        self.slots = BoundedSemaphore(app.config.get("PASSWORD_QUEUE", 16))
+
+    def start(self):
+        # every gunicorn worker has its own pool; the processes are spawned
+        # rather than forked, since a worker runs several threads
+        with self.lock:
+            if self.pid != os.getpid():
+                self.executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self.pid = os.getpid()
+            return self.executor
+
+    def run(self, fn, *args):
+        executor = self.start()
+        with self.slots:
+            start = perf_counter()
+            result = executor.submit(fn, *args).result()
+            elapsed = perf_counter() - start
+        with self.lock:
+            self.calls += 1
+            self.seconds += elapsed
+            calls = self.calls
+        if calls % 100 == 0:
+            self.app.logger.info(f"password pool: {self.metrics()}")
+        return result
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def is_outdated(self, pwhash):
+        # a hash made with other parameters than PASSWORD_METHOD, e.g.
+        # scrypt:32768:8:1 when pbkdf2:sha256:600000 is configured
+        if self.prefix is None:
+            self.prefix = self.hash("").split("$")[0]
+        return pwhash.split("$")[0] != self.prefix
+
+    def metrics(self):
+        # the time spent on hashes once a slot was taken, waiting for a
+        # worker process included
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "seconds": round(self.seconds, 3),
+                "average": (
+                    round(self.seconds / self.calls, 4) if self.calls else 0
+                ),
+            }
@@ -0,0 +1,120 @@
+from collections import namedtuple
+
+from flask import current_app, url_for
+
+from omeg.conf.boost import send_email
+from omeg.data.load import CPF, DATE, payload
+from omeg.mold.models import Enrollment, Professor
+
+# every kind of email: its subject, its templates (a .txt and an .html one,
+# named without the extension), the endpoint its link points to and the
+# function that gives the address and the template fields of a recipient
+Letter = namedtuple("Letter", ["subject", "template", "endpoint", "fields"])
+
+
+def registration_fields(email):
+    token = Professor.get_registration_request_token(email)
+    return email, {"token": token}
+
+
+def password_fields(professor):
+    token = professor.get_reset_password_token()
+    return professor.email, {"fname": professor.fname, "token": token}
+
+
+def enrollment_fields(enrollment):
+    # enrollment holds the arguments of get_enrollment_request_token
+    token = Enrollment.get_enrollment_request_token(**enrollment)
+    return enrollment["semail"], {
+        "pfname": enrollment["pfname"],
+        "cpf": CPF(enrollment["cpfnr"]).strfmt("fmt"),
+        "sfname": enrollment["sfname"],
+        "birthday": DATE(enrollment["birth"]).strfmt("dd-mm-yyyy"),
+        "semail": enrollment["semail"],
+        "name": enrollment["name"],
+        "roll": enrollment["roll"],
+        "token": token,
+    }
+
+
+letters = {
+    "registration": Letter(
+        "[OMEG] Cadastro de Professor",
+        "auth/registration/request/mail",
+        "bp_auth_routes.registration",
+        registration_fields,
+    ),
+    "password": Letter(
+        "[OMEG] Redefinição de senha",
+        "auth/password/request/mail",
+        "bp_auth_routes.password_reset",
+        password_fields,
+    ),
+    "enrollment": Letter(
+        "[OMEG] Inscrição na Olimpíada de Matemática do Estado de Goiás",
+        "user/enrollment/create/mail",
+        "bp_user_routes.enroll_student",
+        enrollment_fields,
+    ),
+}
+
+
+def link_maker(endpoint):
+    # the url is built once and only the token changes from one recipient to
+    # the next; tokens are url-safe, so they need no quoting
+    head, tail = url_for(endpoint, token="TOKEN", _external=True).split(
+        "TOKEN"
+    )
+    return lambda token: f"{head}{token}{tail}"
+
+
+def render(kind, recipients):
+    # (address, text body, html body) for every recipient; the templates
+    # are looked up and the link is built once per call, and the fields are
+    # formatted once per recipient instead of inside each template
+    letter = letters[kind]
+    env = current_app.jinja_env
+    text = env.get_template(f"{letter.template}.txt")
+    html = env.get_template(f"{letter.template}.html")
+    link = link_maker(letter.endpoint)
+    for recipient in recipients:
+        email, fields = letter.fields(recipient)
+        fields["link"] = link(fields["token"])
+        yield email, text.render(fields), html.render(fields)
+
+
+def send(kind, recipients):
+    letter = letters[kind]
+    sender = current_app.config["ADMINS"][0]
+    for email, text_body, html_body in render(kind, recipients):
+        send_email(letter.subject, sender, [email], text_body, html_body)
+
+
+def campaign_letter(campaign):
+    # the bodies of a campaign are compiled once; they may use the fname and
+    # email of the professor, the edition, its dates (as dd-mm-yyyy) and the
+    # days until each of them
+    # the environment escapes whatever it compiles from a string, which
+    # suits the html body but not the text one
+    env = current_app.jinja_env
+    text = env.from_string(
+        f"{{% autoescape false %}}{campaign.text_body}{{% endautoescape %}}"
+    )
+    html = env.from_string(campaign.html_body) if campaign.html_body else None
+    common = {
+        "edition": payload["edition"],
+        "save_the_date": {
+            period: {
+                event: day.strfmt("dd-mm-yyyy")
+                for event, day in events.items()
+            }
+            for period, events in payload["save_the_date"].items()
+        },
+        "days_until": payload["days_until"],
+    }
+
+    def letter(fname, email):
+        fields = dict(common, fname=fname, email=email)
+        return text.render(fields), html.render(fields) if html else ""
+
+    return letter
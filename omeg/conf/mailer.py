@@ -0,0 +1,139 @@
+import os
+import queue
+import smtplib
+from collections import Counter
+from threading import Lock, Thread
+
+
+class MailPool:
+    # a fixed number of sender threads per worker, each one keeping its own
+    # SMTP connection open between messages; messages wait in a bounded
+    # queue and, once it is full, the caller waits for room instead of more
+    # threads being started
+    def __init__(self, mail):
+        self.mail = mail
+        self.app = None
+        self.lock = Lock()
+        self.pid = None
+        self.queue = None
+        self.threads = []
+        self.counts = Counter()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get("MAIL_WORKERS", 2)
+        self.size = app.config.get("MAIL_QUEUE_SIZE", 256)
+        self.wait = app.config.get("MAIL_QUEUE_WAIT", 10)
+        self.idle = app.config.get("MAIL_IDLE", 60)
+
+    def start(self):
+        # threads do not survive a fork, so every gunicorn worker starts its
+        # own senders the first time it has something to send
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.size)
+            self.threads = [
+                Thread(target=self.run, daemon=True)
+                for _ in range(self.workers)
+            ]
+            for thread in self.threads:
+                thread.start()
+            self.pid = os.getpid()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def submit(self, msg, done=None):
+        # `done`, if given, is called by the sender with the error that kept
+        # the message from being sent, or None
+        self.start()
+        try:
+            self.queue.put((msg, done), timeout=self.wait)
+            self.count("queued")
+        except queue.Full:
+            # the senders are too far behind: the caller pays for sending
+            # this one itself, which slows callers down instead of piling up
+            # messages without bound
+            self.count("overflow")
+            connection, error = self.deliver(None, msg)
+            self.close(connection)
+            self.finish(done, error)
+
+    def open(self):
+        connection = self.mail.connect()
+        connection.__enter__()
+        self.count("connections")
+        return connection
+
+    def close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+    def deliver(self, connection, msg):
+        # a connection the server dropped while idle shows up as an error on
+        # the next message, which is then sent again over a new connection
+        # the connection to keep using comes back with the error, if any
+        error = None
+        for _ in range(2):
+            try:
+                if connection is None:
+                    connection = self.open()
+                connection.send(msg)
+                self.count("sent")
+                return connection, None
+            except (smtplib.SMTPException, OSError) as e:
+                connection, error = self.close(connection), e
+                self.count("reconnects")
+            except Exception as e:
+                # the message itself cannot be sent, e.g. a bad header;
+                # sending it again would not help, and the connection is
+                # replaced as it may be halfway through a message
+                connection, error = self.close(connection), e
+                break
+        self.count("failed")
+        self.app.logger.error(f"email to {msg.recipients} not sent: {error}")
+        return connection, error
+
+    def run(self):
+        with self.app.app_context():
+            connection = None
+            while True:
+                try:
+                    msg, done = self.queue.get(timeout=self.idle)
+                except queue.Empty:
+                    if connection is not None:
+                        self.app.logger.info(f"mail pool: {self.metrics()}")
+                    connection = self.close(connection)
+                    continue
+                error = None
+                try:
+                    connection, error = self.deliver(connection, msg)
+                except Exception as e:
+                    # nothing may end a sender: the message is given up and
+                    # a new connection is opened for the next one
+                    connection, error = self.close(connection), e
+                    self.count("failed")
+                    self.app.logger.exception("mail pool: sender error")
+                finally:
+                    self.finish(done, error)
+                    self.queue.task_done()
+
+    def finish(self, done, error):
+        if done is not None:
+            try:
+                done(error)
+            except Exception:
+                self.app.logger.exception("mail pool: callback error")
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.counts)
+        metrics["waiting"] = self.queue.qsize() if self.queue else 0
+        metrics["senders"] = sum(thread.is_alive() for thread in self.threads)
+        return metrics
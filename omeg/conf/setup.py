@@ -14,4 +14,15 @@ class Config:
     MAIL_USE_TLS = os.environ.get("MAIL_USE_TLS")
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
+    MAIL_WORKERS = int(os.environ.get("MAIL_WORKERS", 2))
+    MAIL_QUEUE_SIZE = int(os.environ.get("MAIL_QUEUE_SIZE", 256))
+    MAIL_QUEUE_WAIT = float(os.environ.get("MAIL_QUEUE_WAIT", 10))
+    MAIL_IDLE = float(os.environ.get("MAIL_IDLE", 60))
     ADMINS = os.environ.get("ADMINS")
+    # werkzeug's generate_password_hash method, e.g. pbkdf2:sha256:600000
+    PASSWORD_METHOD = os.environ.get("PASSWORD_METHOD", "scrypt")
+    PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", 2))
+    PASSWORD_QUEUE = int(os.environ.get("PASSWORD_QUEUE", 16))
+    SCHOOL_CATALOGUE = os.environ.get(
+        "SCHOOL_CATALOGUE", os.path.join(basedir, "schools.bin")
+    )
@@ -0,0 +1,67 @@
+from time import time
+
+import jwt
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from omeg.conf.boost import db
+from omeg.conf.cache import TTLCache
+from omeg.conf.setup import Config
+from omeg.mold.models import SpentToken
+
+# the claims of every token this worker has verified, kept until the token
+# expires, so that the pages behind a link decode it once and not on every
+# GET and POST
+verified_tokens = TTLCache(ttl=600, maxsize=4096)
+# the jti of the tokens this worker knows were used
+spent_tokens = TTLCache(ttl=600, maxsize=4096)
+
+
+@sa.event.listens_for(so.Session, "after_commit")
+def remember_spent_tokens(session):
+    for jti, expires in session.info.pop("spent", []):
+        spent_tokens.set(jti, True, ttl=expires - time())
+
+
+@sa.event.listens_for(so.Session, "after_rollback")
+def discard_spent_tokens(session):
+    session.info.pop("spent", None)
+
+
+def is_spent(jti):
+    if spent_tokens.get(jti):
+        return True
+    if db.session.get(SpentToken, jti) is not None:
+        spent_tokens.set(jti, True)
+        return True
+    return False
+
+
+def claims_of(token):
+    claims = verified_tokens.get(token)
+    if claims is None:
+        claims = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
+        verified_tokens.set(token, claims, ttl=claims["exp"] - time())
+    return claims
+
+
+def decode(token):
+    # like jwt.decode, and a token that was already used is invalid; tokens
+    # without a jti were sent before tokens could be spent and are let be
+    claims = claims_of(token)
+    if "jti" in claims and is_spent(claims["jti"]):
+        raise jwt.exceptions.InvalidTokenError("Token was already used")
+    return claims
+
+
+def spend(token):
+    # joins the caller's transaction: of two requests spending the same
+    # token, the second one to commit fails on the primary key
+    claims = claims_of(token)
+    if "jti" in claims:
+        db.session.add(
+            SpentToken(jti=claims["jti"], expires=int(claims["exp"]) + 1)
+        )
+        db.session.info.setdefault("spent", []).append(
+            (claims["jti"], claims["exp"])
+        )
@@ -7,14 +7,14 @@ def create_app():
 
     omeg.config.from_object(Config)
 
+    from omeg.auth.identity import load_identity
     from omeg.conf.boost import login_manager
-    from omeg.mold.models import Professor
 
     login_manager.init_app(omeg)
 
     @login_manager.user_loader
     def load_user(taxnr):
-        return Professor.query.get(taxnr)
+        return load_identity(taxnr)
 
     from omeg.conf.boost import db
 
@@ -24,9 +24,14 @@ def create_app():
 
     migrate.init_app(omeg, db)
 
-    from omeg.conf.boost import mail
+    from omeg.conf.boost import mail, mailpool
 
     mail.init_app(omeg)
+    mailpool.init_app(omeg)
+
+    from omeg.conf.boost import passwords
+
+    passwords.init_app(omeg)
 
     from omeg.home.routes import bp_home_routes
 
@@ -40,6 +45,10 @@ def create_app():
 
     omeg.register_blueprint(bp_user_routes, url_prefix="/user")
 
+    from omeg.data.cmds import bp_data_cmds
+
+    omeg.register_blueprint(bp_data_cmds)
+
     return omeg
 
 
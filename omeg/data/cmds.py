@@ -0,0 +1,849 @@
+import csv
+import queue
+import random
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Barrier, BrokenBarrierError, Lock, Thread
+from time import monotonic, perf_counter, sleep, time
+
+import click
+import sqlalchemy as sa
+from flask import Blueprint, current_app, render_template, url_for
+from flask_mail import Message
+from jinja2 import TemplateSyntaxError
+from sqlalchemy.dialects import mysql, sqlite
+
+from omeg.conf.boost import db, mailpool, passwords, send_email
+from omeg.conf.cache import bump
+from omeg.conf.letters import (
+    campaign_letter,
+    enrollment_fields,
+    letters,
+    render,
+)
+from omeg.data.load import CPF, DATE, batch_digits_match, payload
+from omeg.data.schools import build
+from omeg.mold.models import (
+    Campaign,
+    Edition,
+    Enrollment,
+    Outbox,
+    Professor,
+    School,
+    SpentToken,
+    Student,
+)
+from omeg.user.queries import (
+    eligibility_of,
+    enrollment_of,
+    enrollments_of,
+    extract_cache,
+    extract_of,
+    has_a_seat,
+    medalists_of,
+    previous_enrollment_of,
+    refresh_histories,
+    seats_taken_of,
+    students_extract_query,
+    students_of,
+)
+
+bp_data_cmds = Blueprint("bp_data_cmds", __name__, cli_group="data")
+
+
+def hot_queries():
+    # the statements the views run, built by the same functions, for a
+    # made-up professor, student and school
+    year = str(payload["edition"])
+    taxnr, cpfnr, inep = "00000000000", "00000000000", "52000000"
+    return {
+        "quota": seats_taken_of(inep, 1, year),
+        "extract": extract_of(taxnr, year),
+        "students": students_of(taxnr, year),
+        "listing": enrollments_of(taxnr, year),
+        "enrollment": enrollment_of(taxnr, cpfnr, year),
+        "medalists": medalists_of(str(int(year) - 1)),
+        "eligibility": eligibility_of(cpfnr, inep, 1, year),
+        "history": previous_enrollment_of(cpfnr),
+    }
+
+
+def explain(stmt):
+    # returns the access paths chosen for the enrollment table and whether
+    # any of them scans the whole table; a statement may read the table
+    # more than once, e.g. in subqueries
+    sql = stmt.compile(db.engine, compile_kwargs={"literal_binds": True})
+    paths = []
+    if db.engine.dialect.name == "sqlite":
+        rows = db.session.execute(sa.text(f"EXPLAIN QUERY PLAN {sql}"))
+        for row in rows.mappings():
+            if re.search(r" enrollment(_\d+)? ", row["detail"]):
+                detail = row["detail"]
+                paths.append((detail, detail.startswith("SCAN")))
+    else:
+        rows = db.session.execute(sa.text(f"EXPLAIN {sql}"))
+        for row in rows.mappings():
+            if re.fullmatch(r"enrollment(_\d+)?", row["table"] or ""):
+                detail = f"type={row['type']}, key={row['key']}"
+                paths.append((detail, row["type"] == "ALL"))
+    if not paths:
+        return "enrollment not read", False
+    return (
+        "; ".join(detail for detail, scan in paths),
+        any(scan for detail, scan in paths),
+    )
+
+
+@bp_data_cmds.cli.command("explain")
+def explain_hot_queries():
+    """Check that the hot enrollment queries are answered by an index."""
+    scans = 0
+    for name, stmt in hot_queries().items():
+        detail, scan = explain(stmt)
+        scans += scan
+        click.echo(f"{'SCAN' if scan else 'ok':4} {name:11} {detail}")
+    if scans:
+        raise SystemExit(1)
+
+
+@bp_data_cmds.cli.command("results")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_results(path):
+    """Import medals from a CSV file with columns cpfnr, year and gift."""
+    stmt = (
+        sa.update(Enrollment.__table__)
+        .where(
+            Enrollment.cpfnr == sa.bindparam("b_cpfnr"),
+            Enrollment.year == sa.bindparam("b_year"),
+        )
+        .values(gift=sa.bindparam("b_gift"))
+    )
+    batch, total = [], 0
+    with open(path, newline="") as csvfile:
+        for line, row in enumerate(csv.DictReader(csvfile), start=2):
+            cpfnr = CPF(row["cpfnr"].strip()).strfmt("raw")
+            gift = row["gift"].strip().upper()
+            if cpfnr is None or gift not in ["O", "P", "B", "H", "N"]:
+                raise click.ClickException(f"{path}:{line}: {row}")
+            batch.append(
+                {"b_cpfnr": cpfnr, "b_year": row["year"], "b_gift": gift}
+            )
+            if len(batch) == 1000:
+                db.session.execute(stmt, batch)
+                refresh_histories(db.session, {b["b_cpfnr"] for b in batch})
+                total += len(batch)
+                batch = []
+    if batch:
+        db.session.execute(stmt, batch)
+        refresh_histories(db.session, {b["b_cpfnr"] for b in batch})
+        total += len(batch)
+    bump("medalists")
+    db.session.commit()
+    click.echo(f"{total} results imported")
+
+
+@bp_data_cmds.cli.command("catalogue")
+def build_catalogue():
+    """Rebuild the school catalogue mapped by the web workers."""
+    path = current_app.config["SCHOOL_CATALOGUE"]
+    click.echo(f"{build(path)} schools written to {path}")
+
+
+def upsert(table):
+    # one INSERT that updates the rows whose primary key already exists;
+    # executed with many parameter sets it is sent as multi-row inserts
+    columns = [
+        column.name for column in table.columns if not column.primary_key
+    ]
+    if db.engine.dialect.name == "sqlite":
+        stmt = sqlite.insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_={column: stmt.excluded[column] for column in columns},
+        )
+    stmt = mysql.insert(table)
+    return stmt.on_duplicate_key_update(
+        {column: stmt.inserted[column] for column in columns}
+    )
+
+
+re_inep = re.compile(r"\d{8}")
+
+
+def census_row(row):
+    # a School row out of a census line, or the reason it is not one
+    school = {
+        "inep": row["inep"].strip(),
+        "name": re.sub(r"\s+", r" ", row["name"]).strip(),
+        "city": row["city"].strip(),
+        "zone": row["zone"].strip(),
+        "tier": row["tier"].strip(),
+        "code": re.sub(r"\D", r"", row["code"]),
+        "pnum": re.sub(r"\D", r"", row.get("pnum") or "") or None,
+    }
+    if not re_inep.fullmatch(school["inep"]):
+        return "inep must have 8 digits"
+    for column, size in [
+        ("name", 96),
+        ("city", 27),
+        ("zone", 6),
+        ("tier", 7),
+        ("code", 9),
+        ("pnum", 14),
+    ]:
+        if column != "pnum" and not school[column]:
+            return f"{column} is missing"
+        if school[column] and len(school[column]) > size:
+            return f"{column} is longer than {size} characters"
+    for column, bound in [("latd", 90), ("lotd", 180)]:
+        value = (row.get(column) or "").strip().replace(",", ".")
+        try:
+            school[column] = float(value) if value else None
+        except ValueError:
+            return f"{column} is not a number"
+        if value and not -bound <= school[column] <= bound:
+            return f"{column} is out of range"
+    return school
+
+
+@bp_data_cmds.cli.command("schools")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--delimiter", default=";", show_default=True)
+@click.option("--encoding", default="utf-8", show_default=True)
+@click.option("--batch", default=5000, show_default=True)
+def load_schools(path, delimiter, encoding, batch):
+    """Load the INEP school census from a CSV file.
+
+    The file needs the columns inep, name, city, zone, tier, code, pnum,
+    latd and lotd. Rows are inserted or updated by inep.
+    """
+    stmt = upsert(School.__table__)
+    rows, loaded, rejected = [], 0, 0
+    start = monotonic()
+    with open(path, newline="", encoding=encoding) as csvfile:
+        reader = csv.DictReader(csvfile, delimiter=delimiter)
+        for line, row in enumerate(reader, start=2):
+            school = census_row(row)
+            if isinstance(school, str):
+                rejected += 1
+                click.echo(f"{path}:{line}: {school}", err=True)
+                continue
+            rows.append(school)
+            if len(rows) == batch:
+                db.session.execute(stmt, rows)
+                loaded += len(rows)
+                rows = []
+                click.echo(f"{loaded} schools ({monotonic() - start:.1f}s)")
+    if rows:
+        db.session.execute(stmt, rows)
+        loaded += len(rows)
+    db.session.commit()
+    click.echo(
+        f"{loaded} schools loaded, {rejected} rejected "
+        f"({monotonic() - start:.1f}s)"
+    )
+    path = current_app.config["SCHOOL_CATALOGUE"]
+    click.echo(f"{build(path)} schools written to {path}")
+
+
+@bp_data_cmds.cli.command("students")
+@click.argument("taxnr")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_student_list(taxnr, path):
+    """Register and enroll the students of a CSV file with a professor."""
+    from omeg.user.bulk import import_students
+
+    if db.session.get(Professor, taxnr) is None:
+        raise click.ClickException(f"Professor {taxnr} does not exist")
+    with open(path, encoding="utf-8-sig") as csvfile:
+        try:
+            report, imported = import_students(taxnr, csvfile.read())
+        except ValueError as Err:
+            raise click.ClickException(str(Err))
+    for line, student, errors in report:
+        if errors:
+            click.echo(f"{path}:{line}: {'; '.join(errors)}", err=True)
+    if not imported:
+        raise click.ClickException("nothing was imported")
+    click.echo(f"{len(report)} students imported")
+
+
+@bp_data_cmds.cli.command("edition")
+@click.option("--year", help="Defaults to the current edition.")
+@click.option("--quota", type=int)
+@click.option("--opening", help="Dates are given as yyyymmdd.")
+@click.option("--closing")
+@click.option("--step1")
+@click.option("--step2")
+def set_edition(year, **changes):
+    """Change the settings of an edition, creating it if needed.
+
+    A new edition becomes the current one at once, so all of its dates
+    must be given; its quota defaults to the one of the current edition.
+    Running workers pick the new settings up within a few seconds.
+    """
+    year = year or str(payload["edition"])
+    edition = db.session.get(Edition, year, with_for_update=True)
+    if edition is None:
+        missing = [
+            f"--{field}"
+            for field in ["opening", "closing", "step1", "step2"]
+            if changes[field] is None
+        ]
+        if missing:
+            raise click.UsageError(f"a new edition needs {', '.join(missing)}")
+        edition = Edition(year=year, quota=payload["quota"])
+        db.session.add(edition)
+    for field, value in changes.items():
+        if value is None:
+            continue
+        if field != "quota":
+            value = DATE(value)
+            if not value.exists():
+                raise click.BadParameter(f"{field} is not a date")
+            value = value.isofmt()
+        setattr(edition, field, value)
+    bump("edition")
+    db.session.commit()
+    click.echo(
+        f"edition {edition.year}: quota {edition.quota}, registration "
+        f"{edition.opening}-{edition.closing}, steps {edition.step1} and "
+        f"{edition.step2}"
+    )
+
+
+def claim(batch, attempts, lease):
+    # the next emails that are due, held for `lease` seconds by pushing
+    # their due time ahead: if this sender dies, another one picks them up
+    # after that; SKIP LOCKED keeps concurrent senders off each other's rows
+    now = datetime.now()
+    emails = db.session.scalars(
+        sa.select(Outbox)
+        .where(
+            Outbox.sent.is_(None),
+            Outbox.due <= now,
+            Outbox.attempts < attempts,
+        )
+        .order_by(Outbox.due)
+        .limit(batch)
+        .with_for_update(skip_locked=True)
+    ).all()
+    for email in emails:
+        email.due = now + timedelta(seconds=lease)
+    db.session.commit()
+    return emails
+
+
+def message(subject, sender, recipients, text_body, html_body):
+    msg = Message(subject, sender=sender, recipients=recipients)
+    msg.body = text_body
+    msg.html = html_body
+    return msg
+
+
+def dispatch(msgs, rate=None, timeout=300):
+    # hands the (key, message) pairs to the mail pool, no more than `rate`
+    # per second if given, and waits for every one of them; the errors are
+    # returned by key, and messages not reported on within `timeout` seconds
+    # of the last submission count as failed
+    results = queue.Queue()
+    due = monotonic()
+    for key, msg in msgs:
+        if rate:
+            wait = due - monotonic()
+            if wait > 0:
+                sleep(wait)
+            due = max(due, monotonic()) + 1 / rate
+        mailpool.submit(msg, lambda error, key=key: results.put((key, error)))
+    errors = {}
+    deadline = monotonic() + timeout
+    try:
+        while len(errors) < len(msgs):
+            key, error = results.get(timeout=max(0, deadline - monotonic()))
+            errors[key] = error
+    except queue.Empty:
+        for key, msg in msgs:
+            errors.setdefault(key, TimeoutError(f"not sent in {timeout}s"))
+    return errors
+
+
+@bp_data_cmds.cli.command("outbox")
+@click.option("--batch", default=100, show_default=True)
+@click.option("--attempts", default=8, show_default=True)
+@click.option("--backoff", default=30, show_default=True, help="Seconds.")
+@click.option("--lease", default=300, show_default=True, help="Seconds.")
+@click.option("--poll", default=5, show_default=True, help="Seconds.")
+@click.option("--once", is_flag=True, help="Stop when nothing is due.")
+def send_outbox(batch, attempts, backoff, lease, poll, once):
+    """Send the emails waiting in the outbox.
+
+    Failed emails are tried again after BACKOFF seconds, doubling the wait
+    each time, until they have been tried ATTEMPTS times. Several senders
+    may run at once.
+    """
+    while True:
+        emails = claim(batch, attempts, lease)
+        if not emails:
+            if once:
+                break
+            sleep(poll)
+            continue
+        errors = dispatch(
+            [
+                (
+                    email.id,
+                    message(
+                        email.subject,
+                        email.sender,
+                        email.recipients.split(","),
+                        email.text_body,
+                        email.html_body,
+                    ),
+                )
+                for email in emails
+            ]
+        )
+        now = datetime.now()
+        sent = 0
+        for email in emails:
+            error = errors[email.id]
+            if error is None:
+                email.sent = now
+                sent += 1
+            else:
+                email.attempts += 1
+                email.due = now + timedelta(
+                    seconds=backoff * 2 ** (email.attempts - 1)
+                )
+                email.error = (str(error) or type(error).__name__)[:255]
+        db.session.commit()
+        click.echo(f"{sent} sent, {len(emails) - sent} to be tried again")
+
+
+@bp_data_cmds.cli.command("campaign-new")
+@click.argument("subject")
+@click.argument("text", type=click.File(encoding="utf-8"))
+@click.option("--html", type=click.File(encoding="utf-8"))
+def new_campaign(subject, text, html):
+    """Create an email campaign to every professor.
+
+    TEXT, and the optional HTML, are Jinja templates that may use fname,
+    email, edition, save_the_date and days_until.
+    """
+    campaign = Campaign(
+        subject=subject,
+        text_body=text.read(),
+        html_body=html.read() if html else "",
+    )
+    try:
+        campaign_letter(campaign)
+    except TemplateSyntaxError as error:
+        raise click.ClickException(f"broken template: {error}")
+    db.session.add(campaign)
+    db.session.commit()
+    click.echo(f"campaign {campaign.id} created, send it with:")
+    click.echo(f"  flask data campaign {campaign.id}")
+
+
+@bp_data_cmds.cli.command("campaign")
+@click.argument("id", type=int)
+@click.option("--rate", default=10.0, show_default=True, help="Emails/s.")
+@click.option("--batch", default=200, show_default=True)
+def send_campaign(id, rate, batch):
+    """Send a campaign, or resume it from where it stopped.
+
+    Professors are read in batches, in taxnr order, and the progress is
+    saved after every batch, so an interrupted campaign resends at most one
+    batch. Emails that fail are left in the outbox to be tried again.
+    """
+    campaign = db.session.get(Campaign, id)
+    if campaign is None:
+        raise click.ClickException(f"there is no campaign {id}")
+    if campaign.finished is not None:
+        click.echo(f"campaign {id} was finished on {campaign.finished}")
+        return
+    letter = campaign_letter(campaign)
+    sender = current_app.config["ADMINS"][0]
+    while True:
+        # keyset batches rather than one long server-side cursor: at a
+        # throttled rate the cursor would hold a snapshot open for the whole
+        # campaign, while each batch is a short range read on the key
+        chunk = db.session.execute(
+            sa.select(Professor.taxnr, Professor.fname, Professor.email)
+            .where(Professor.taxnr > campaign.cursor)
+            .order_by(Professor.taxnr)
+            .limit(batch)
+        ).all()
+        if not chunk:
+            break
+        bodies = {
+            taxnr: (email, *letter(fname, email))
+            for taxnr, fname, email in chunk
+        }
+        errors = dispatch(
+            [
+                (taxnr, message(campaign.subject, sender, [email], *body))
+                for taxnr, (email, *body) in bodies.items()
+            ],
+            rate,
+        )
+        for taxnr, error in errors.items():
+            if error is None:
+                campaign.sent += 1
+            else:
+                email, text_body, html_body = bodies[taxnr]
+                send_email(
+                    campaign.subject, sender, [email], text_body, html_body
+                )
+                campaign.failed += 1
+        campaign.cursor = chunk[-1].taxnr
+        db.session.commit()
+        click.echo(
+            f"{campaign.sent} sent, {campaign.failed} left in the outbox"
+        )
+    campaign.finished = datetime.now()
+    db.session.commit()
+
+
+@bp_data_cmds.cli.command("purge-tokens")
+def purge_tokens():
+    """Forget the used tokens that have expired since."""
+    purged = db.session.execute(
+        sa.delete(SpentToken).where(SpentToken.expires < time())
+    ).rowcount
+    db.session.commit()
+    click.echo(f"{purged} expired tokens purged")
+
+
+@bp_data_cmds.cli.command("bench-cpf")
+@click.option("--size", default=200000, show_default=True)
+def bench_cpf(size):
+    """Time CPF validation, one string at a time and as a batch."""
+    cpfnrs = []
+    for _ in range(size):
+        cpfnr = f"{random.randrange(10**9):09d}"
+        # a valid CPF half of the time
+        if random.random() < 0.5:
+            for n in [10, 11]:
+                d = sum((n - i) * int(c) for i, c in enumerate(cpfnr))
+                cpfnr += str(((10 * d) % 11) % 10)
+        else:
+            cpfnr += f"{random.randrange(100):02d}"
+        if random.random() < 0.5:
+            cpfnr = f"{cpfnr[:3]}.{cpfnr[3:6]}.{cpfnr[6:9]}-{cpfnr[9:]}"
+        # blanks around the number are fine, other text is not
+        cpfnr = random.choice(["", " ", "\t"]) + cpfnr
+        cpfnr += random.choice(["", "", " ", " abc", "0", "x"])
+        cpfnrs.append(cpfnr)
+    start = perf_counter()
+    scalar = [CPF(cpfnr).digits_match() for cpfnr in cpfnrs]
+    scalar_time = perf_counter() - start
+    start = perf_counter()
+    valid, raw = batch_digits_match(cpfnrs)
+    batch_time = perf_counter() - start
+    scalar_raw = [
+        CPF(cpfnr).strfmt("raw") if ok else None
+        for cpfnr, ok in zip(cpfnrs, scalar)
+    ]
+    if list(valid) != scalar or list(raw) != scalar_raw:
+        raise click.ClickException("the two paths disagree")
+    click.echo(f"scalar: {size / scalar_time:12.0f} CPF/s")
+    click.echo(f"batch:  {size / batch_time:12.0f} CPF/s")
+
+
+@bp_data_cmds.cli.command("bench-mail")
+@click.option("--size", default=5000, show_default=True)
+def bench_mail(size):
+    """Time the rendering of enrollment emails on a single core.
+
+    Messages are rendered one render_template pair at a time, as views
+    used to, and in a single batch.
+    """
+    enrollments = [
+        {
+            "taxnr": f"{random.randrange(10**11):011d}",
+            "pfname": "Professora de Matemática",
+            "cpfnr": f"{random.randrange(10**11):011d}",
+            "sfname": f"Estudante Número {n}",
+            "birth": f"2010{random.randint(1, 12):02d}"
+            f"{random.randint(1, 28):02d}",
+            "semail": f"estudante{n}@example.com",
+            "inep": "52000000",
+            "name": "Colégio Estadual de Goiás",
+            "roll": random.randint(1, 3),
+        }
+        for n in range(size)
+    ]
+    letter = letters["enrollment"]
+    with current_app.test_request_context():
+        start = perf_counter()
+        for enrollment in enrollments:
+            email, fields = enrollment_fields(enrollment)
+            for ext in ["txt", "html"]:
+                render_template(
+                    f"{letter.template}.{ext}",
+                    link=url_for(
+                        letter.endpoint, token=fields["token"], _external=True
+                    ),
+                    **fields,
+                )
+        single_time = perf_counter() - start
+        start = perf_counter()
+        for email, text_body, html_body in render("enrollment", enrollments):
+            pass
+        batch_time = perf_counter() - start
+    click.echo(f"one at a time: {size / single_time:8.0f} messages/s")
+    click.echo(f"batched:       {size / batch_time:8.0f} messages/s")
+
+
+@bp_data_cmds.cli.command("bench-eligibility")
+@click.option("--size", default=200000, show_default=True)
+@click.option("--checks", default=50, show_default=True)
+def bench_eligibility(size, checks):
+    """Time the checks of a new enrollment from a previous one.
+
+    An edition of SIZE enrollments is made up in an in-memory SQLite
+    database; the checks are run as the view used to, loading every
+    enrollment of the edition, and as a single statement.
+    """
+    year = str(payload["edition"])
+    engine = sa.create_engine("sqlite://")
+    Enrollment.__table__.create(engine)
+    ineps = [f"52{n:06d}" for n in range(size // 100)]
+    rows = [
+        {
+            "cpfnr": f"{n:011d}",
+            "taxnr": f"{n % 1000:011d}",
+            "inep": random.choice(ineps),
+            "year": year,
+            "roll": random.randint(1, 3),
+            "gift": "N",
+        }
+        for n in range(size)
+    ]
+    # last edition: a tenth of the students, one in ten of them a medalist
+    rows += [
+        dict(row, year=str(int(year) - 1), gift=random.choice("OPBHNNNNNN"))
+        for row in rows[::10]
+    ]
+    probes = [
+        (f"{random.randrange(2 * size):011d}", random.choice(ineps))
+        for _ in range(checks)
+    ]
+    with engine.connect() as conn:
+        conn.execute(sa.insert(Enrollment), rows)
+        start = perf_counter()
+        before = []
+        for cpfnr, inep in probes:
+            enrolled = list(
+                conn.scalars(
+                    sa.select(Enrollment.cpfnr).where(Enrollment.year == year)
+                )
+            )
+            exempt = frozenset(conn.scalars(medalists_of(str(int(year) - 1))))
+            taken = conn.scalars(
+                sa.select(Enrollment.cpfnr).where(
+                    Enrollment.inep == inep,
+                    Enrollment.year == year,
+                    Enrollment.roll == 1,
+                )
+            )
+            before.append(
+                (
+                    cpfnr in enrolled,
+                    cpfnr in exempt,
+                    sum(cpfnr not in exempt for cpfnr in taken),
+                )
+            )
+        before_time = perf_counter() - start
+        start = perf_counter()
+        after = [
+            tuple(conn.execute(eligibility_of(cpfnr, inep, 1, year)).one())
+            for cpfnr, inep in probes
+        ]
+        after_time = perf_counter() - start
+    if [tuple(map(int, b)) for b in before] != after:
+        raise click.ClickException("the two paths disagree")
+    click.echo(f"loading the edition: {checks / before_time:10.1f} checks/s")
+    click.echo(f"single statement:    {checks / after_time:10.1f} checks/s")
+
+
+def remove_made_up(inep, taxnr, cpfnrs):
+    # whatever bench-admission got to write, however far it got
+    db.session.rollback()
+    for enrollment in db.session.scalars(
+        sa.select(Enrollment).where(Enrollment.inep == inep)
+    ):
+        db.session.delete(enrollment)
+    db.session.flush()
+    for student in db.session.scalars(
+        sa.select(Student).where(Student.cpfnr.in_(cpfnrs))
+    ):
+        db.session.delete(student)
+    for obj in [
+        db.session.get(Professor, taxnr),
+        db.session.get(School, inep),
+    ]:
+        if obj is not None:
+            db.session.delete(obj)
+    db.session.commit()
+
+
+@bp_data_cmds.cli.command("bench-admission")
+@click.option("--students", default=300, show_default=True)
+@click.option(
+    "--i-know-this-writes",
+    "writes",
+    is_flag=True,
+    help="Run against a database other than SQLite.",
+)
+def bench_admission(students, writes):
+    """Register STUDENTS students into one school and roll at once.
+
+    Every registration runs in a thread of its own, through has_a_seat as
+    the views do, and they all start together. A school, a professor and
+    the students are made up for the test and removed afterwards, even if
+    the test is interrupted; the command fails if more students were
+    admitted than the quota allows. It writes to DATABASE_URI, so it only
+    runs against anything but SQLite when --i-know-this-writes is given.
+    """
+    if db.engine.dialect.name != "sqlite" and not writes:
+        raise click.UsageError(
+            f"this writes to {db.engine.url.render_as_string()}; "
+            "pass --i-know-this-writes to go on"
+        )
+    app = current_app._get_current_object()
+    inep, taxnr, year = "99999999", "99999999999", str(payload["edition"])
+    if db.session.get(School, inep) is not None:
+        raise click.ClickException(f"school {inep} is already there")
+    cpfnrs = [f"9{n:010d}" for n in range(students)]
+    outcomes, lock = Counter(), Lock()
+    start = Barrier(students, timeout=60)
+
+    def register(cpfnr):
+        with app.app_context():
+            try:
+                start.wait()
+                if has_a_seat(inep, 1, cpfnr):
+                    db.session.add(
+                        Enrollment(
+                            cpfnr=cpfnr,
+                            taxnr=taxnr,
+                            inep=inep,
+                            year=year,
+                            roll=1,
+                            gift="N",
+                        )
+                    )
+                    db.session.commit()
+                    outcome = "admitted"
+                else:
+                    db.session.rollback()
+                    outcome = "refused"
+            except (sa.exc.DBAPIError, BrokenBarrierError):
+                db.session.rollback()
+                outcome = "errors"
+            with lock:
+                outcomes[outcome] += 1
+
+    threads = [Thread(target=register, args=(cpfnr,)) for cpfnr in cpfnrs]
+    try:
+        db.session.add(
+            School(
+                inep=inep,
+                name="Escola de Teste",
+                city="Teste",
+                zone="Urbana",
+                tier="Estadual",
+                code="00000000",
+            )
+        )
+        db.session.add(
+            Professor(taxnr=taxnr, fname="Teste", email="teste@omeg")
+        )
+        db.session.add_all(
+            Student(
+                cpfnr=cpfnr,
+                fname="Teste",
+                birth="20100101",
+                email=f"{cpfnr}@omeg",
+            )
+            for cpfnr in cpfnrs
+        )
+        db.session.commit()
+        begin = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - begin
+        enrolled = db.session.scalar(
+            sa.select(sa.func.count())
+            .select_from(Enrollment)
+            .where(Enrollment.inep == inep, Enrollment.year == year)
+        )
+    finally:
+        # threads still waiting to start give up, the others are let finish
+        start.abort()
+        for thread in threads:
+            if thread.is_alive():
+                thread.join()
+        remove_made_up(inep, taxnr, cpfnrs)
+    click.echo(
+        f"{students} registrations in {elapsed:.2f}s: "
+        f"{outcomes['admitted']} admitted, {outcomes['refused']} refused, "
+        f"{outcomes['errors']} failed; quota {payload['quota']}, "
+        f"{enrolled} enrolled"
+    )
+    if enrolled > payload["quota"] or enrolled != outcomes["admitted"]:
+        raise click.ClickException("the quota was not kept")
+
+
+@bp_data_cmds.cli.command("cache-stats")
+@click.option("--professors", default=0, show_default=True)
+def cache_stats(professors):
+    """Print the hit and miss counters of the identity and extract caches.
+
+    The counters belong to the process that reads them: web workers log
+    theirs every 1000 logins. With PROFESSORS, that many professors are
+    looked up twice here first, as two requests of each one would.
+    """
+    from omeg.auth.identity import identity_cache, load_identity
+
+    taxnrs = db.session.scalars(
+        sa.select(Professor.taxnr).order_by(Professor.taxnr).limit(professors)
+    ).all()
+    for _ in range(2):
+        for taxnr in taxnrs:
+            load_identity(taxnr)
+            students_extract_query(taxnr)
+    for name, cache in [
+        ("identity", identity_cache),
+        ("extract", extract_cache),
+    ]:
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / lookups if lookups else 0
+        click.echo(
+            f"{name:8} hits {stats['hits']:8} misses {stats['misses']:8} "
+            f"size {stats['size']:6} hit ratio {ratio:.0%}"
+        )
+
+
+@bp_data_cmds.cli.command("bench-passwords")
+@click.option("--size", default=50, show_default=True)
+@click.option("--threads", default=8, show_default=True)
+def bench_passwords(size, threads):
+    """Time SIZE logins, from THREADS threads, through the password pool."""
+    pwhash = passwords.hash("senha1234")
+
+    def login(_):
+        passwords.check(pwhash, "senha1234")
+
+    start = perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(login, range(size)))
+    elapsed = perf_counter() - start
+    click.echo(f"{size / elapsed:.1f} logins/s, pool: {passwords.metrics()}")
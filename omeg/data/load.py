@@ -1,16 +1,28 @@
 import re
-from datetime import datetime
+from collections.abc import Mapping
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from threading import Lock
+
+import numpy as np
+import sqlalchemy as sa
+from flask import has_app_context
+
+from omeg.conf.boost import db
+from omeg.conf.cache import StampedCache
 
 
 class CPF:
     re_cpfnr = re.compile(r"\b(\d{3})\.?(\d{3})\.?(\d{3})-?(\d{2})\b")
 
     def __init__(self, cpfnr):
-        self.cpfnr = cpfnr
+        # surrounding blanks are ignored, anything else around the number
+        # makes it invalid; batch_digits_match follows the same rules
+        self.cpfnr = cpfnr.strip()
 
     def pattern_match(self):
         B = False
-        if self.re_cpfnr.match(self.cpfnr):
+        if self.re_cpfnr.fullmatch(self.cpfnr):
             B = True
         return B
 
@@ -45,7 +57,56 @@ class CPF:
         return self.strfmt("fmt")
 
 
+def batch_digits_match(cpfnrs):
+    # CPF(cpfnr).digits_match() and CPF(cpfnr).strfmt("raw") for a whole
+    # array of strings at once: returns a boolean array telling which ones
+    # are valid and an array with their raw forms (None where invalid)
+    text = np.char.strip(np.asarray(cpfnrs, dtype=str))
+    size = len(text)
+    wide = np.char.str_len(text) > 14
+    codes = (
+        np.char.encode(np.where(wide, "", text), "ascii", "replace")
+        .astype("S14")
+        .view(np.uint8)
+        .reshape(size, 14)
+    )
+    digit = (codes >= ord("0")) & (codes <= ord("9"))
+    # digits seen before each position: the optional separators of
+    # ddd.ddd.ddd-dd may only appear after the 3rd, 6th and 9th digit
+    before = np.cumsum(digit, axis=1) - digit
+    dot = codes == ord(".")
+    dash = codes == ord("-")
+    other = ~(digit | dot | dash | (codes == 0))
+    misplaced = (dot & (before != 3) & (before != 6)) | (dash & (before != 9))
+    shape = (
+        ~wide
+        & (digit.sum(axis=1) == 11)
+        & ~(other | misplaced).any(axis=1)
+        & ((dot & (before == 3)).sum(axis=1) <= 1)
+        & ((dot & (before == 6)).sum(axis=1) <= 1)
+        & (dash.sum(axis=1) <= 1)
+    )
+    digits = codes[shape][digit[shape]].reshape(-1, 11).astype(np.int64) - 48
+    D0 = digits[:, :9] @ np.arange(10, 1, -1)
+    D1 = digits[:, :10] @ np.arange(11, 1, -1)
+    match = (
+        (((10 * D0) % 11) % 10 == digits[:, 9])
+        & (((10 * D1) % 11) % 10 == digits[:, 10])
+        & digits.any(axis=1)
+    )
+    valid = np.zeros(size, dtype=bool)
+    valid[shape] = match
+    raw = np.full(size, None, dtype=object)
+    raw[shape] = (digits + 48).astype(np.uint8).view("S11").ravel().astype(str)
+    raw[~valid] = None
+    return valid, raw
+
+
 class DATE:
+    # DATE(datestr) is parsed once: instances are immutable and the last
+    # few thousand of them are kept by input string, see parse_date
+    __slots__ = ("datestr", "ymd", "date", "formats")
+
     re_d = r"0[1-9]|[12][0-9]|3[01]"
     re_m = r"0[1-9]|1[012]"
     re_y = r"[0-9]{4}"
@@ -53,93 +114,59 @@ class DATE:
     dt_1 = re.compile(r"\b(%s)[/-]?(%s)[/-]?(%s)\b" % (re_y, re_m, re_d))
     dt_2 = re.compile(r"\b(%s)[/-]?(%s)[/-]?(%s)\b" % (re_d, re_m, re_y))
 
-    def __init__(self, datestr):
-        self.datestr = datestr
+    style = {
+        "yyyy-mm-dd": "{0}-{1}-{2}",
+        "yyyy/mm/dd": "{0}/{1}/{2}",
+        "dd-mm-yyyy": "{2}-{1}-{0}",
+        "dd/mm/yyyy": "{2}/{1}/{0}",
+    }
+
+    def __new__(cls, datestr):
+        return parse_date(datestr)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DATE is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("DATE is immutable")
 
     def patterns_match(self):
-        B = False
-        if self.dt_1.match(self.datestr) or self.dt_2.match(self.datestr):
-            B = True
-        return B
+        return self.ymd is not None
 
     def dissect(self):
-        DISSECT = None
-        if self.patterns_match():
-            if self.dt_1.match(self.datestr):
-                Y = self.dt_1.match(self.datestr).group(1)
-                M = self.dt_1.match(self.datestr).group(2)
-                D = self.dt_1.match(self.datestr).group(3)
-            else:
-                Y = self.dt_2.match(self.datestr).group(3)
-                M = self.dt_2.match(self.datestr).group(2)
-                D = self.dt_2.match(self.datestr).group(1)
-            DISSECT = Y, M, D
-        return DISSECT
+        return self.ymd
 
     def exists(self):
-        B = False
-        if self.patterns_match():
-            Y, M, D = self.dissect()
-            y, m, d = int(Y), int(M), int(D)
-            ndays = {
-                1: 31,
-                2: 28,
-                3: 31,
-                4: 30,
-                5: 31,
-                6: 30,
-                7: 31,
-                8: 31,
-                9: 30,
-                10: 31,
-                11: 30,
-                12: 31,
-            }
-            is_leap_year = False
-            if (y % 4 == 0 and y % 100 != 0) or (y % 400 == 0):
-                is_leap_year = True
-            if is_leap_year and (m == 2):
-                ndays[m] += 1
-            if d <= ndays[m]:
-                B = True
-        return B
+        return self.date is not None
 
     def isofmt(self):
         isoformat = None
         if self.exists():
-            Y, M, D = self.dissect()
-            isoformat = f"{Y}{M}{D}"
+            isoformat = "".join(self.ymd)
         return isoformat
 
     def dateobj(self):
-        dobj = None
-        if self.exists():
-            dobj = datetime.fromisoformat(self.isofmt())
-        return dobj
+        return self.date
 
     def strfmt(self, fmt):
         strfmt = None
         if self.exists():
-            style = {
-                "yyyy-mm-dd": "%Y-%m-%d",
-                "yyyy/mm/dd": "%Y/%m/%d",
-                "dd-mm-yyyy": "%d-%m-%Y",
-                "dd/mm/yyyy": "%d/%m/%Y",
-            }
-            strfmt = self.dateobj().strftime(style[fmt])
+            strfmt = self.formats.get(fmt)
+            if strfmt is None:
+                strfmt = self.formats[fmt] = self.style[fmt].format(*self.ymd)
         return strfmt
 
     def is_not_in_the_future(self):
         B = False
         if self.exists():
-            if self.dateobj() <= datetime.now():
+            if self.date <= datetime.now():
                 B = True
         return B
 
     def year_belongs_to_selected_range(self):
         B = False
         if self.exists():
-            if self.dateobj().year in range(1974, 2021):
+            if self.date.year in range(1974, 2021):
                 B = True
         return B
 
@@ -147,6 +174,53 @@ class DATE:
         return self.isofmt()
 
 
+@lru_cache(maxsize=4096)
+def parse_date(datestr):
+    # a single regex match per input string; the date only exists when the
+    # day fits in the month of that year
+    ymd = date = None
+    match = DATE.dt_1.match(datestr)
+    if match:
+        ymd = match.group(1, 2, 3)
+    else:
+        match = DATE.dt_2.match(datestr)
+        if match:
+            ymd = match.group(3, 2, 1)
+    if ymd is not None:
+        y, m, d = int(ymd[0]), int(ymd[1]), int(ymd[2])
+        ndays = {
+            1: 31,
+            2: 28,
+            3: 31,
+            4: 30,
+            5: 31,
+            6: 30,
+            7: 31,
+            8: 31,
+            9: 30,
+            10: 31,
+            11: 30,
+            12: 31,
+        }
+        is_leap_year = False
+        if (y % 4 == 0 and y % 100 != 0) or (y % 400 == 0):
+            is_leap_year = True
+        if is_leap_year and (m == 2):
+            ndays[m] += 1
+        # there is no year 0, and datetime refuses it
+        if y >= 1 and d <= ndays[m]:
+            date = datetime(y, m, d)
+    value = object.__new__(DATE)
+    for name, field in [
+        ("datestr", datestr),
+        ("ymd", ymd),
+        ("date", date),
+        ("formats", {}),
+    ]:
+        object.__setattr__(value, name, field)
+    return value
+
+
 def beancount(dt1, dt2):
     if dt1 < dt2:
         beans = f"{(dt2 - dt1).days} dias"
@@ -155,40 +229,120 @@ def beancount(dt1, dt2):
     return beans
 
 
-save_the_date = {
-    "registration": {
-        "opening": DATE("20240615"),
-        "closing": DATE("20240715"),
-    },
-    "step": {
-        "1": DATE("20240914"),
-        "2": DATE("20241005"),
-    },
-}
-
-
-payload = {
-    "edition": 2024,
-    "quota": 10,
-    "save_the_date": save_the_date,
-    "days_until": {
-        "registration": {
-            "opening": beancount(
-                datetime.today(),
-                save_the_date["registration"]["opening"].dateobj(),
-            ),
-            "closing": beancount(
-                datetime.today(),
-                save_the_date["registration"]["closing"].dateobj(),
-            ),
+def default_edition():
+    # the settings used outside of the app and while the edition table is
+    # still empty; the table is seeded with the same ones, see
+    # flask data edition to change them
+    settings = {
+        "edition": 2024,
+        "quota": 10,
+        "save_the_date": {
+            "registration": {
+                "opening": "20240615",
+                "closing": "20240715",
+            },
+            "step": {
+                "1": "20240914",
+                "2": "20241005",
+            },
         },
-        "step": {
-            "1": beancount(
-                datetime.today(), save_the_date["step"]["1"].dateobj()
-            ),
-            "2": beancount(
-                datetime.today(), save_the_date["step"]["2"].dateobj()
-            ),
+    }
+    settings["save_the_date"] = {
+        period: {event: DATE(day) for event, day in events.items()}
+        for period, events in settings["save_the_date"].items()
+    }
+    return settings
+
+
+class Calendar:
+    # the countdowns to the edition dates only change at midnight, so they
+    # are computed once a day instead of once per request (or once per
+    # worker, which left long-lived workers showing stale numbers)
+    def __init__(self):
+        self.lock = Lock()
+        self.save_the_date = None
+        self.countdowns = None
+        self.expires = None
+
+    def days_until(self, save_the_date):
+        now = datetime.now()
+        with self.lock:
+            if (
+                self.save_the_date is not save_the_date
+                or self.expires is None
+                or now >= self.expires
+            ):
+                self.countdowns = {
+                    period: {
+                        event: beancount(now, day.dateobj())
+                        for event, day in events.items()
+                    }
+                    for period, events in save_the_date.items()
+                }
+                self.save_the_date = save_the_date
+                self.expires = datetime.combine(
+                    now.date() + timedelta(days=1), time()
+                )
+            return self.countdowns
+
+
+def current_edition():
+    from omeg.mold.models import Edition
+
+    edition = db.session.scalar(
+        sa.select(Edition).order_by(Edition.year.desc()).limit(1)
+    )
+    if edition is None:
+        return None
+    return {
+        "edition": int(edition.year),
+        "quota": edition.quota,
+        "save_the_date": {
+            "registration": {
+                "opening": DATE(edition.opening),
+                "closing": DATE(edition.closing),
+            },
+            "step": {
+                "1": DATE(edition.step1),
+                "2": DATE(edition.step2),
+            },
         },
-    },
-}
+    }
+
+
+class Payload(Mapping):
+    # the settings come from the edition table through a per-worker cache,
+    # so that a new quota reaches every worker within a few seconds without
+    # a query per request; outside of the app, or while the table is still
+    # empty, the defaults are used. payload["days_until"] is worked out by
+    # the calendar when it is read
+    def __init__(self, defaults):
+        self.defaults = defaults
+        self.cache = StampedCache("edition")
+        self.calendar = Calendar()
+
+    def settings(self):
+        if not has_app_context():
+            return self.defaults
+        settings = self.cache.get("current")
+        if settings is None:
+            settings = self.cache.set(
+                "current", current_edition() or self.defaults
+            )
+        return settings
+
+    def __getitem__(self, key):
+        settings = self.settings()
+        if key == "days_until":
+            return self.calendar.days_until(settings["save_the_date"])
+        return settings[key]
+
+    def __iter__(self):
+        yield from self.settings()
+        yield "days_until"
+
+    def __len__(self):
+        return len(self.settings()) + 1
+
+
+payload = Payload(default_edition())
@@ -0,0 +1,246 @@
+import math
+import mmap
+import os
+import struct
+from collections import namedtuple
+from threading import Lock
+from time import monotonic
+
+import sqlalchemy as sa
+from flask import current_app
+
+from omeg.conf.boost import db
+
+# The catalogue is a read-only file with every School in it:
+#
+#   header | records sorted by inep | record numbers sorted by (city, inep)
+#
+# Records are fixed-width, so the n-th one starts at a known offset and an
+# inep is found by binary search. Every worker maps the same file, so the
+# pages are shared through the page cache instead of being copied into
+# each process.
+
+MAGIC = b"OMEGSCH1"
+HEADER = struct.Struct("<8sI4x")
+# widths are in bytes: accented names take two bytes per character
+LAYOUT = [
+    ("inep", "8s"),
+    ("name", "192s"),
+    ("city", "54s"),
+    ("zone", "12s"),
+    ("tier", "14s"),
+    ("code", "9s"),
+    ("pnum", "14s"),
+    ("latd", "d"),
+    ("lotd", "d"),
+]
+RECORD = struct.Struct("<" + "".join(code for name, code in LAYOUT))
+NUMBER = struct.Struct("<I")
+
+SchoolRecord = namedtuple("SchoolRecord", [name for name, code in LAYOUT])
+
+
+def span(field):
+    # (start, end) of a field within a record, for the comparisons that
+    # are made on the raw bytes
+    codes = [code for name, code in LAYOUT]
+    n = [name for name, code in LAYOUT].index(field)
+    start = struct.calcsize("<" + "".join(codes[:n]))
+    return start, start + struct.calcsize("<" + codes[n])
+
+
+INEP = span("inep")
+CITY = span("city")
+INEP_WIDTH = INEP[1] - INEP[0]
+
+
+def pack(school):
+    return RECORD.pack(
+        school.inep.encode(),
+        school.name.encode(),
+        school.city.encode(),
+        school.zone.encode(),
+        school.tier.encode(),
+        school.code.encode(),
+        (school.pnum or "").encode(),
+        math.nan if school.latd is None else school.latd,
+        math.nan if school.lotd is None else school.lotd,
+    )
+
+
+def text(field):
+    return field.rstrip(b"\0").decode(errors="ignore")
+
+
+def unpack(buffer, offset):
+    inep, name, city, zone, tier, code, pnum, latd, lotd = RECORD.unpack_from(
+        buffer, offset
+    )
+    return SchoolRecord(
+        text(inep),
+        text(name),
+        text(city),
+        text(zone),
+        text(tier),
+        text(code),
+        text(pnum) or None,
+        None if math.isnan(latd) else latd,
+        None if math.isnan(lotd) else lotd,
+    )
+
+
+def build(path):
+    from omeg.mold.models import School
+
+    # plain rows rather than ORM objects: a national census is big
+    schools = db.session.execute(
+        sa.select(School.__table__).order_by(School.inep)
+    ).all()
+    by_city = sorted(
+        range(len(schools)),
+        key=lambda n: (schools[n].city, schools[n].inep),
+    )
+    # written aside and renamed, so that workers never map a partial file
+    partial = f"{path}.{os.getpid()}"
+    with open(partial, "wb") as catalogue:
+        catalogue.write(HEADER.pack(MAGIC, len(schools)))
+        for school in schools:
+            catalogue.write(pack(school))
+        for n in by_city:
+            catalogue.write(NUMBER.pack(n))
+    os.replace(partial, path)
+    return len(schools)
+
+
+class Catalogue:
+    def __init__(self, path):
+        with open(path, "rb") as catalogue:
+            self.stat = os.fstat(catalogue.fileno())
+            self.buffer = mmap.mmap(
+                catalogue.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        magic, self.count = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a school catalogue")
+        self.by_city = HEADER.size + self.count * RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def inep_at(self, n):
+        offset = HEADER.size + n * RECORD.size
+        return self.buffer[offset + INEP[0] : offset + INEP[1]]
+
+    def record(self, n):
+        return unpack(self.buffer, HEADER.size + n * RECORD.size)
+
+    def find(self, inep):
+        # the record number of `inep`, or None
+        if not isinstance(inep, str) or len(inep) > INEP_WIDTH:
+            return None
+        key = inep.encode().ljust(INEP_WIDTH, b"\0")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.inep_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.inep_at(lo) == key:
+            return lo
+        return None
+
+    def __contains__(self, inep):
+        return self.find(inep) is not None
+
+    def get(self, inep):
+        n = self.find(inep)
+        return None if n is None else self.record(n)
+
+    def __iter__(self):
+        for n in range(self.count):
+            yield self.record(n)
+
+    def number_at(self, i):
+        # the record number standing at position i of the (city, inep) order
+        return NUMBER.unpack_from(self.buffer, self.by_city + i * NUMBER.size)[
+            0
+        ]
+
+    def city_key(self, n):
+        offset = HEADER.size + n * RECORD.size
+        return (
+            self.buffer[offset + CITY[0] : offset + CITY[1]].rstrip(b"\0"),
+            self.buffer[offset + INEP[0] : offset + INEP[1]],
+        )
+
+    def seek(self, city, inep=""):
+        # position of the first record that comes after (city, inep) in the
+        # (city, inep) order; seek(city) is where that city starts
+        key = (
+            city.encode(),
+            inep.encode().ljust(INEP_WIDTH, b"\0") if inep else b"",
+        )
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.city_key(self.number_at(mid)) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def city_order(self, start=0):
+        # records in (city, inep) order, from position `start` on
+        for i in range(start, self.count):
+            yield self.record(self.number_at(i))
+
+    def page(self, after=None, city="", tier="", size=100):
+        # keyset pagination over the (city, inep) order: `after` is the inep
+        # of the last school of the previous page
+        last = self.get(after) if after else None
+        if last is not None:
+            start = self.seek(last.city, last.inep)
+        elif city:
+            start = self.seek(city)
+        else:
+            start = 0
+        shown = 0
+        for school in self.city_order(start):
+            if shown == size or (city and school.city != city):
+                break
+            if tier and school.tier != tier:
+                continue
+            shown += 1
+            yield school
+
+    def is_current(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) == (
+            self.stat.st_ino,
+            self.stat.st_mtime_ns,
+        )
+
+
+lock = Lock()
+state = {"catalogue": None, "checked": None}
+
+
+def catalogue(poll=5):
+    # the mapped catalogue of this worker; the file is looked at once every
+    # `poll` seconds and mapped again when it was rebuilt in the meantime
+    path = current_app.config["SCHOOL_CATALOGUE"]
+    now = monotonic()
+    with lock:
+        current = state["catalogue"]
+        if current is not None and now - state["checked"] < poll:
+            return current
+        if current is None or not current.is_current(path):
+            if not os.path.exists(path):
+                build(path)
+            current = state["catalogue"] = Catalogue(path)
+        state["checked"] = now
+        return current
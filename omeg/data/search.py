@@ -0,0 +1,99 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from heapq import nsmallest
+from threading import Lock
+
+from unidecode import unidecode
+
+from omeg.data.schools import catalogue
+
+re_split = re.compile(r"[^a-z0-9]+")
+
+
+def words(text):
+    return [word for word in re_split.split(unidecode(text).lower()) if word]
+
+
+def trigrams(word):
+    word = f"  {word} "
+    return {word[i : i + 3] for i in range(len(word) - 2)}
+
+
+class SchoolIndex:
+    # an accent-insensitive index over the names and cities of the schools
+    # in the catalogue: word prefixes are found by bisecting the sorted
+    # vocabulary, and misspelled words are matched to the vocabulary by
+    # trigram similarity
+    def __init__(self, schools):
+        self.schools = list(schools)
+        # matches are listed in the (city, inep) order of the catalogue
+        self.rank = [0] * len(schools)
+        for i in range(len(schools)):
+            self.rank[schools.number_at(i)] = i
+        postings = defaultdict(set)
+        for n, school in enumerate(self.schools):
+            for word in words(f"{school.name} {school.city}"):
+                postings[word].add(n)
+        self.words = sorted(postings)
+        self.postings = [postings[word] for word in self.words]
+        self.trigrams = defaultdict(list)
+        self.sizes = []
+        for i, word in enumerate(self.words):
+            grams = trigrams(word)
+            for gram in grams:
+                self.trigrams[gram].append(i)
+            self.sizes.append(len(grams))
+
+    def prefixed(self, prefix):
+        found = set()
+        i = bisect_left(self.words, prefix)
+        while i < len(self.words) and self.words[i].startswith(prefix):
+            found |= self.postings[i]
+            i += 1
+        return found
+
+    def resembling(self, word, threshold=0.4):
+        grams = trigrams(word)
+        shared = defaultdict(int)
+        for gram in grams:
+            for i in self.trigrams.get(gram, ()):
+                shared[i] += 1
+        found = set()
+        for i, count in shared.items():
+            if count / (len(grams) + self.sizes[i] - count) >= threshold:
+                found |= self.postings[i]
+        return found
+
+    def match(self, query, lookup):
+        found = None
+        for word in sorted(query, key=len, reverse=True):
+            matches = lookup(word)
+            found = matches if found is None else found & matches
+            if not found:
+                return set()
+        return found
+
+    def search(self, text, limit=10):
+        query = words(text)
+        if not query:
+            return []
+        found = self.match(query, self.prefixed)
+        if not found:
+            found = self.match(query, self.resembling)
+        ranked = nsmallest(limit, found, key=self.rank.__getitem__)
+        return [self.schools[n] for n in ranked]
+
+
+lock = Lock()
+state = {"catalogue": None, "index": None}
+
+
+def school_index():
+    # built once per worker and again whenever the catalogue is rebuilt
+    schools = catalogue()
+    with lock:
+        if state["catalogue"] is not schools:
+            state["index"] = SchoolIndex(schools)
+            state["catalogue"] = schools
+        return state["index"]
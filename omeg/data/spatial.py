@@ -0,0 +1,118 @@
+import math
+from collections import defaultdict
+from heapq import nsmallest
+from threading import Lock
+
+from omeg.data.schools import catalogue
+
+EARTH = 6371.0
+# kilometres per degree of latitude
+DEGREE = math.pi * EARTH / 180
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH * math.asin(math.sqrt(h))
+
+
+class SchoolGrid:
+    # the schools with coordinates, bucketed in square cells of `cell`
+    # degrees; a query only visits the cells around the given point
+    def __init__(self, schools, cell=0.1):
+        self.schools = schools
+        self.cell = cell
+        self.cells = defaultdict(list)
+        farthest = 0.0
+        for n, school in enumerate(schools):
+            if school.latd is None or school.lotd is None:
+                continue
+            self.cells[self.key(school.latd, school.lotd)].append(
+                (n, school.latd, school.lotd)
+            )
+            farthest = max(farthest, abs(school.latd))
+        # the shortest side of a cell, in kilometres, anywhere in the data
+        self.side = cell * DEGREE * math.cos(math.radians(min(farthest, 89)))
+        self.bounds = [
+            min((i for i, j in self.cells), default=0),
+            max((i for i, j in self.cells), default=0),
+            min((j for i, j in self.cells), default=0),
+            max((j for i, j in self.cells), default=0),
+        ]
+
+    def key(self, lat, lon):
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def reach(self, i, j):
+        # how many rings around cell (i, j) it takes to cover every school
+        if not self.cells:
+            return -1
+        imin, imax, jmin, jmax = self.bounds
+        return max(abs(i - imin), abs(i - imax), abs(j - jmin), abs(j - jmax))
+
+    def ring(self, i, j, r):
+        # the cells at Chebyshev distance r from cell (i, j), leaving out the
+        # ones outside the bounds of the data
+        imin, imax, jmin, jmax = self.bounds
+        if r == 0:
+            yield i, j
+            return
+        jlo, jhi = max(j - r, jmin), min(j + r, jmax)
+        for row in [i - r, i + r]:
+            if imin <= row <= imax:
+                for col in range(jlo, jhi + 1):
+                    yield row, col
+        ilo, ihi = max(i - r + 1, imin), min(i + r - 1, imax)
+        for col in [j - r, j + r]:
+            if jmin <= col <= jmax:
+                for row in range(ilo, ihi + 1):
+                    yield row, col
+
+    def nearest(self, lat, lon, k=10):
+        # the k schools closest to (lat, lon) as (km, school) pairs; rings
+        # of cells are visited until no unvisited cell can be closer than
+        # the k-th school found so far
+        if k <= 0:
+            return []
+        i, j = self.key(lat, lon)
+        found = []
+        for r in range(self.reach(i, j) + 1):
+            for cell in self.ring(i, j, r):
+                for n, latd, lotd in self.cells.get(cell, ()):
+                    found.append((haversine(lat, lon, latd, lotd), n))
+            if len(found) >= k:
+                found = nsmallest(k, found)
+                if found[-1][0] <= r * self.side:
+                    break
+        return [(km, self.schools[n]) for km, n in sorted(found)[:k]]
+
+    def within(self, lat, lon, km):
+        # every school at most `km` kilometres away from (lat, lon), closest
+        # first, as (km, school) pairs
+        i, j = self.key(lat, lon)
+        found = []
+        last = min(math.ceil(km / self.side), self.reach(i, j))
+        for r in range(last + 1):
+            for cell in self.ring(i, j, r):
+                for n, latd, lotd in self.cells.get(cell, ()):
+                    distance = haversine(lat, lon, latd, lotd)
+                    if distance <= km:
+                        found.append((distance, n))
+        return [(distance, self.schools[n]) for distance, n in sorted(found)]
+
+
+lock = Lock()
+state = {"catalogue": None, "grid": None}
+
+
+def school_grid():
+    # built once per worker and again whenever the catalogue is rebuilt
+    schools = catalogue()
+    with lock:
+        if state["catalogue"] is not schools:
+            state["grid"] = SchoolGrid(list(schools))
+            state["catalogue"] = schools
+        return state["grid"]
@@ -1,13 +1,14 @@
+from datetime import datetime
 from time import time
 from typing import Optional
+from uuid import uuid4
 
 import jwt
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 from flask_login import UserMixin
-from werkzeug.security import check_password_hash, generate_password_hash
 
-from omeg.conf.boost import db
+from omeg.conf.boost import db, passwords
 from omeg.conf.setup import Config
 
 
@@ -27,35 +28,44 @@ class School(db.Model):
 
 
 class Professor(UserMixin, db.Model):
-    taxnr: so.Mapped[str] = so.mapped_column(sa.String(11), primary_key=True)
+    taxnr: so.Mapped[str] = so.mapped_column(
+        sa.String(11), primary_key=True, active_history=True
+    )
     fname: so.Mapped[str] = so.mapped_column(sa.String(255))
     email: so.Mapped[str] = so.mapped_column(
-        sa.String(255), index=True, unique=True
+        sa.String(255), index=True, unique=True, active_history=True
     )
     pswrd: so.Mapped[Optional[str]] = so.mapped_column(sa.String(255))
 
     def set_password(self, password):
-        self.pswrd = generate_password_hash(password)
+        self.pswrd = passwords.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.pswrd, password)
+        return passwords.check(self.pswrd, password)
+
+    def password_is_outdated(self):
+        return passwords.is_outdated(self.pswrd)
 
     def get_id(self):
         return self.taxnr
 
     def get_reset_password_token(self, expires_in=600):
         return jwt.encode(
-            {"reset_password": self.taxnr, "exp": time() + expires_in},
+            {
+                "reset_password": self.taxnr,
+                "exp": time() + expires_in,
+                "jti": uuid4().hex,
+            },
             Config.SECRET_KEY,
             algorithm="HS256",
         )
 
     @staticmethod
     def verify_reset_password_token(token):
+        from omeg.conf.tokens import decode
+
         try:
-            taxnr = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])[
-                "reset_password"
-            ]
+            taxnr = decode(token)["reset_password"]
         except jwt.exceptions.InvalidTokenError as Err:
             print(Err)
             return None
@@ -64,17 +74,17 @@ class Professor(UserMixin, db.Model):
     @staticmethod
     def get_registration_request_token(email, expires_in=600):
         return jwt.encode(
-            {"email": email, "exp": time() + expires_in},
+            {"email": email, "exp": time() + expires_in, "jti": uuid4().hex},
             Config.SECRET_KEY,
             algorithm="HS256",
         )
 
     @staticmethod
     def verify_registration_request_token(token):
+        from omeg.conf.tokens import decode
+
         try:
-            email = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])[
-                "email"
-            ]
+            email = decode(token)["email"]
         except jwt.exceptions.InvalidTokenError as Err:
             print(Err)
             return None
@@ -85,17 +95,72 @@ class Professor(UserMixin, db.Model):
 
 
 class Student(db.Model):
-    cpfnr: so.Mapped[str] = so.mapped_column(sa.String(11), primary_key=True)
+    cpfnr: so.Mapped[str] = so.mapped_column(
+        sa.String(11), primary_key=True, active_history=True
+    )
     fname: so.Mapped[str] = so.mapped_column(sa.String(255))
     birth: so.Mapped[str] = so.mapped_column(sa.String(8))
     email: so.Mapped[str] = so.mapped_column(
-        sa.String(255), index=True, unique=True
+        sa.String(255), index=True, unique=True, active_history=True
     )
 
     def __repr__(self):
         return f"Student {self.cpfnr}"
 
 
+class Identity(db.Model):
+    # every CPF and email in use, by professors and students alike: whether
+    # a value is taken is a single primary key probe, and the database
+    # refuses a second owner; rows follow the professors and students
+    # through register_identities below
+    #
+    # acceptable values:
+    # kind:
+    #   'cpf'
+    #   'email'
+    kind: so.Mapped[str] = so.mapped_column(sa.String(5), primary_key=True)
+    value: so.Mapped[str] = so.mapped_column(sa.String(255), primary_key=True)
+
+    @staticmethod
+    def is_taken(kind, value):
+        return db.session.get(Identity, (kind, value)) is not None
+
+    def __repr__(self):
+        return f"Identity {self.kind} {self.value}"
+
+
+# the identities of each model, as attribute: kind; those attributes load
+# their old value before a change (active_history), so it can be freed
+identities = {
+    Professor: {"taxnr": "cpf", "email": "email"},
+    Student: {"cpfnr": "cpf", "email": "email"},
+}
+
+
+@sa.event.listens_for(so.Session, "before_flush")
+def register_identities(session, flush_context, instances):
+    taken, freed = [], []
+    for obj in session.new:
+        for attr, kind in identities.get(type(obj), {}).items():
+            taken.append((kind, getattr(obj, attr)))
+    for obj in session.dirty:
+        state = sa.inspect(obj)
+        for attr, kind in identities.get(type(obj), {}).items():
+            history = state.attrs[attr].history
+            if history.has_changes():
+                freed += [(kind, value) for value in history.deleted]
+                taken += [(kind, value) for value in history.added]
+    for obj in session.deleted:
+        for attr, kind in identities.get(type(obj), {}).items():
+            freed.append((kind, getattr(obj, attr)))
+    for kind, value in freed:
+        identity = session.get(Identity, (kind, value))
+        if identity is not None:
+            session.delete(identity)
+    for kind, value in taken:
+        session.add(Identity(kind=kind, value=value))
+
+
 class Enrollment(db.Model):
     cpfnr: so.Mapped[str] = so.mapped_column(
         sa.String(11),
@@ -129,6 +194,21 @@ class Enrollment(db.Model):
     #   'N' meaning 'Nenhum'
     gift: so.Mapped[chr] = so.mapped_column(sa.CHAR, default="N")
 
+    @so.validates("gift")
+    def validate_gift(self, key, gift):
+        return gift.upper()
+
+    __table_args__ = (
+        # quota check per school and level
+        sa.Index("ix_enrollment_inep_year_roll", "inep", "year", "roll"),
+        # professor's listings and extracts
+        sa.Index("ix_enrollment_taxnr_year", "taxnr", "year"),
+        # medalists of a given edition
+        sa.Index("ix_enrollment_year_gift", "year", "gift"),
+        # is the student enrolled in a given edition?
+        sa.Index("ix_enrollment_cpfnr_year", "cpfnr", "year"),
+    )
+
     @staticmethod
     def get_enrollment_request_token(
         taxnr,
@@ -154,6 +234,7 @@ class Enrollment(db.Model):
                 "name": name,
                 "roll": roll,
                 "exp": time() + expires_in,
+                "jti": uuid4().hex,
             },
             Config.SECRET_KEY,
             algorithm="HS256",
@@ -161,10 +242,10 @@ class Enrollment(db.Model):
 
     @staticmethod
     def verify_enrollment_request_token(token):
+        from omeg.conf.tokens import decode
+
         try:
-            decoded = jwt.decode(
-                token, Config.SECRET_KEY, algorithms=["HS256"]
-            )
+            decoded = decode(token)
             message = {
                 "taxnr": decoded["taxnr"],
                 "pfname": decoded["pfname"],
@@ -183,3 +264,102 @@ class Enrollment(db.Model):
 
     def __repr__(self):
         return f"{self.inep}, {self.cpfnr}, {self.year}, {self.roll}"
+
+
+class History(db.Model):
+    # one row per student summing up their enrollments: how many editions
+    # they took part in, how many medals they won, and the school, roll and
+    # gift of their latest edition; kept in step with the enrollments by
+    # omeg.user.queries, see refresh_histories
+    cpfnr: so.Mapped[str] = so.mapped_column(
+        sa.String(11),
+        sa.ForeignKey(Student.cpfnr, onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    editions: so.Mapped[int]
+    medals: so.Mapped[int]
+    year: so.Mapped[str] = so.mapped_column(sa.String(4))
+    inep: so.Mapped[str] = so.mapped_column(sa.String(8))
+    roll: so.Mapped[int]
+    gift: so.Mapped[chr] = so.mapped_column(sa.CHAR, default="N")
+
+    def __repr__(self):
+        return f"History {self.cpfnr} {self.year}"
+
+
+class Stamp(db.Model):
+    # version stamps let every worker know that a cache it keeps in memory
+    # went stale, e.g. 'medalists' is bumped when results are imported
+    name: so.Mapped[str] = so.mapped_column(sa.String(32), primary_key=True)
+    version: so.Mapped[int] = so.mapped_column(default=0)
+
+    def __repr__(self):
+        return f"Stamp {self.name}"
+
+
+class Edition(db.Model):
+    # the settings of each edition; the latest year is the current edition
+    # and every change is published to the workers by bumping 'edition'
+    year: so.Mapped[str] = so.mapped_column(sa.String(4), primary_key=True)
+    quota: so.Mapped[int] = so.mapped_column()
+    opening: so.Mapped[str] = so.mapped_column(sa.String(8))
+    closing: so.Mapped[str] = so.mapped_column(sa.String(8))
+    step1: so.Mapped[str] = so.mapped_column(sa.String(8))
+    step2: so.Mapped[str] = so.mapped_column(sa.String(8))
+
+    def __repr__(self):
+        return f"Edition {self.year}"
+
+
+class Outbox(db.Model):
+    # emails waiting to be sent by `flask data outbox`; they are added in
+    # the same transaction as the change they are about, so that neither
+    # goes without the other. `due` is when the next attempt may happen,
+    # and it is pushed ahead while a sender holds the email
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    subject: so.Mapped[str] = so.mapped_column(sa.String(255))
+    sender: so.Mapped[str] = so.mapped_column(sa.String(255))
+    # comma-separated
+    recipients: so.Mapped[str] = so.mapped_column(sa.Text)
+    text_body: so.Mapped[str] = so.mapped_column(sa.Text)
+    html_body: so.Mapped[str] = so.mapped_column(sa.Text)
+    created: so.Mapped[datetime] = so.mapped_column(default=datetime.now)
+    due: so.Mapped[datetime] = so.mapped_column(default=datetime.now)
+    attempts: so.Mapped[int] = so.mapped_column(default=0)
+    sent: so.Mapped[Optional[datetime]]
+    error: so.Mapped[Optional[str]] = so.mapped_column(sa.String(255))
+
+    __table_args__ = (sa.Index("ix_outbox_sent_due", "sent", "due"),)
+
+    def __repr__(self):
+        return f"Outbox {self.id}"
+
+
+class Campaign(db.Model):
+    # an email to every professor, sent by `flask data campaign`; cursor is
+    # the taxnr of the last professor it was sent to, so that an interrupted
+    # campaign picks up where it stopped
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    subject: so.Mapped[str] = so.mapped_column(sa.String(255))
+    # Jinja templates, the html one may be empty
+    text_body: so.Mapped[str] = so.mapped_column(sa.Text)
+    html_body: so.Mapped[str] = so.mapped_column(sa.Text)
+    created: so.Mapped[datetime] = so.mapped_column(default=datetime.now)
+    cursor: so.Mapped[str] = so.mapped_column(sa.String(11), default="")
+    sent: so.Mapped[int] = so.mapped_column(default=0)
+    failed: so.Mapped[int] = so.mapped_column(default=0)
+    finished: so.Mapped[Optional[datetime]]
+
+    def __repr__(self):
+        return f"Campaign {self.id}"
+
+
+class SpentToken(db.Model):
+    # the jti of every emailed token that was used, kept until the token
+    # expires (a unix time, like the exp of the token) so it cannot be used
+    # again, see omeg/conf/tokens.py
+    jti: so.Mapped[str] = so.mapped_column(sa.String(32), primary_key=True)
+    expires: so.Mapped[int] = so.mapped_column(index=True)
+
+    def __repr__(self):
+        return f"SpentToken {self.jti}"
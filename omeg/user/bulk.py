@@ -0,0 +1,179 @@
+import csv
+import re
+from collections import Counter, defaultdict
+
+import sqlalchemy as sa
+from email_validator import EmailNotValidError, validate_email
+from unidecode import unidecode
+
+from omeg.conf.boost import db
+from omeg.data.load import DATE, batch_digits_match, payload
+from omeg.data.schools import catalogue
+from omeg.mold.models import Enrollment, Identity, Student
+from omeg.user.queries import lock_schools, medalists
+
+COLUMNS = ["cpfnr", "fname", "birth", "email", "roll", "inep", "need"]
+
+
+def read_students(text):
+    # the rows of a CSV export, separated by commas or semicolons
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(text.splitlines(), dialect=dialect)
+    missing = set(COLUMNS) - {"need"} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"Colunas ausentes: {', '.join(sorted(missing))}")
+    rows = list(reader)
+    if not rows:
+        raise ValueError("O arquivo não tem nenhum estudante")
+    return rows
+
+
+def check_row(row, cpfnr):
+    # the normalized row and the problems found looking at it alone; the
+    # cpfnr comes already checked, see batch_digits_match
+    errors = []
+    if cpfnr is None:
+        errors.append("CPF inconsistente")
+    fname = re.sub(r"\s+", r" ", row.get("fname") or "").strip()
+    if not 5 <= len(fname) <= 255:
+        errors.append("Informe o nome completo do estudante")
+    birth = DATE((row.get("birth") or "").strip())
+    if not (
+        birth.exists()
+        and birth.is_not_in_the_future()
+        and birth.year_belongs_to_selected_range()
+    ):
+        errors.append("Data incorreta")
+    email = (row.get("email") or "").strip()
+    try:
+        validate_email(email, check_deliverability=False)
+    except EmailNotValidError:
+        errors.append("Email inválido")
+    roll = (row.get("roll") or "").strip()
+    if roll not in ["1", "2", "3"]:
+        errors.append("Nível deve ser igual a 1, 2 ou 3")
+    inep = (row.get("inep") or "").strip()
+    if inep not in catalogue():
+        errors.append("Código INEP incorreto")
+    need = re.sub(r"\s+", r" ", unidecode((row.get("need") or "").lower()))
+    if len(need) > 255:
+        errors.append("Máximo de 255 caracteres")
+    student = {
+        "cpfnr": cpfnr,
+        "fname": fname,
+        "birth": birth.isofmt(),
+        "email": email,
+        "roll": int(roll) if roll in ["1", "2", "3"] else None,
+        "inep": inep,
+        "need": need.strip(),
+    }
+    return student, errors
+
+
+def taken_identities(cpfnrs, emails):
+    # every cpfnr and email of the batch that already belongs to someone
+    return set(
+        db.session.scalars(
+            sa.select(Identity.value).where(
+                sa.or_(
+                    sa.and_(
+                        Identity.kind == "cpf", Identity.value.in_(cpfnrs)
+                    ),
+                    sa.and_(
+                        Identity.kind == "email", Identity.value.in_(emails)
+                    ),
+                )
+            )
+        )
+    )
+
+
+def seats_left(ineps):
+    # free seats per (inep, roll), with the schools locked until the caller
+    # commits or rolls back: two imports, or an import and a registration,
+    # into the same school wait for each other, see lock_schools
+    lock_schools(ineps)
+    exempt = medalists(payload["edition"] - 1)
+    taken = Counter()
+    rows = db.session.execute(
+        sa.select(Enrollment.inep, Enrollment.roll, Enrollment.cpfnr)
+        .where(
+            Enrollment.inep.in_(ineps),
+            Enrollment.year == payload["edition"],
+        )
+        .with_for_update(read=True)
+    )
+    for inep, roll, cpfnr in rows:
+        if cpfnr not in exempt:
+            taken[(inep, roll)] += 1
+    return defaultdict(
+        lambda: payload["quota"],
+        {key: payload["quota"] - count for key, count in taken.items()},
+    )
+
+
+def import_students(taxnr, text):
+    # registers and enrolls every student of the CSV text with the
+    # professor; either all of them are saved, in a single transaction, or
+    # none is and the report tells what is wrong with each line
+    rows = read_students(text)
+    students, report = [], []
+    valid, raw = batch_digits_match([row.get("cpfnr") or "" for row in rows])
+    for line, row, cpfnr in zip(range(2, len(rows) + 2), rows, raw):
+        student, errors = check_row(row, cpfnr)
+        students.append(student)
+        report.append((line, student, errors))
+    cpfnrs = Counter(student["cpfnr"] for student in students)
+    emails = Counter(student["email"] for student in students)
+    taken = taken_identities(
+        [cpfnr for cpfnr in cpfnrs if cpfnr], list(emails)
+    )
+    for line, student, errors in report:
+        if student["cpfnr"] and cpfnrs[student["cpfnr"]] > 1:
+            errors.append("CPF repetido no arquivo")
+        if emails[student["email"]] > 1:
+            errors.append("Email repetido no arquivo")
+        if student["cpfnr"] in taken:
+            errors.append("CPF já existe em nosso banco de dados")
+        if student["email"] in taken:
+            errors.append("Email já existe em nosso banco de dados")
+    seats = seats_left({student["inep"] for student in students})
+    for line, student, errors in report:
+        if not errors:
+            key = (student["inep"], student["roll"])
+            if seats[key] <= 0:
+                errors.append("Não há mais vagas para este nível nesta escola")
+            seats[key] -= 1
+    if any(errors for line, student, errors in report):
+        db.session.rollback()
+        return report, False
+    for student in students:
+        db.session.add(
+            Student(
+                cpfnr=student["cpfnr"],
+                fname=student["fname"],
+                birth=student["birth"],
+                email=student["email"],
+            )
+        )
+        db.session.add(
+            Enrollment(
+                cpfnr=student["cpfnr"],
+                taxnr=taxnr,
+                inep=student["inep"],
+                year=payload["edition"],
+                roll=student["roll"],
+                need=student["need"],
+                gift="N",
+            )
+        )
+    try:
+        db.session.commit()
+    except sa.exc.IntegrityError:
+        # a CPF or an email was taken by another request in the meantime
+        db.session.rollback()
+        raise ValueError("CPF ou email já existe em nosso banco de dados")
+    return report, True
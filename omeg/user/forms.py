@@ -1,5 +1,5 @@
-import sqlalchemy as sa
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from wtforms import IntegerField, StringField, SubmitField
 from wtforms.validators import (
     DataRequired,
@@ -9,9 +9,9 @@ from wtforms.validators import (
     ValidationError,
 )
 
-from omeg.conf.boost import db
 from omeg.data.load import CPF, DATE
-from omeg.mold.models import Professor, School, Student
+from omeg.data.schools import catalogue
+from omeg.mold.models import Identity
 
 
 class student_registration_form(FlaskForm):
@@ -73,25 +73,13 @@ class student_registration_form(FlaskForm):
     submit = SubmitField("Cadastrar")
 
     def validate_cpfnr(self, cpfnr):
-        professor = db.session.scalar(
-            sa.select(Professor).where(Professor.taxnr == cpfnr.data)
-        )
-        student = db.session.scalar(
-            sa.select(Student).where(Student.cpfnr == cpfnr.data)
-        )
         if not CPF(cpfnr.data).digits_match():
             raise ValidationError("CPF inconsistente")
-        elif (professor is not None) or (student is not None):
+        elif Identity.is_taken("cpf", CPF(cpfnr.data).strfmt("raw")):
             raise ValidationError("CPF já existe em nosso banco de dados")
 
     def validate_email(self, email):
-        professor = db.session.scalar(
-            sa.select(Professor).where(Professor.email == email.data)
-        )
-        student = db.session.scalar(
-            sa.select(Student).where(Student.email == email.data)
-        )
-        if (professor is not None) or (student is not None):
+        if Identity.is_taken("email", email.data):
             raise ValidationError("Email já existe em nosso banco de dados")
 
     def validate_birth(self, birth):
@@ -103,13 +91,21 @@ class student_registration_form(FlaskForm):
             raise ValidationError("Data incorreta")
 
     def validate_inep(self, inep):
-        school = db.session.scalar(
-            sa.select(School).where(School.inep == inep.data)
-        )
-        if school is None:
+        if inep.data not in catalogue():
             raise ValidationError("Código INEP incorreto")
 
 
+class student_import_form(FlaskForm):
+    students = FileField(
+        "Planilha de estudantes (CSV)",
+        validators=[
+            FileRequired(message="Campo obrigatório"),
+            FileAllowed(["csv"], message="Envie um arquivo .csv"),
+        ],
+    )
+    submit = SubmitField("Importar")
+
+
 class edit_student_cpfnr_form(FlaskForm):
     cpfnr = StringField(
         "CPF",
@@ -126,15 +122,9 @@ class edit_student_cpfnr_form(FlaskForm):
     submit = SubmitField("Confirmar")
 
     def validate_cpfnr(self, cpfnr):
-        professor = db.session.scalar(
-            sa.select(Professor).where(Professor.taxnr == cpfnr.data)
-        )
-        student = db.session.scalar(
-            sa.select(Student).where(Student.cpfnr == cpfnr.data)
-        )
         if not CPF(cpfnr.data).digits_match():
             raise ValidationError("CPF inconsistente")
-        elif (professor is not None) or (student is not None):
+        elif Identity.is_taken("cpf", CPF(cpfnr.data).strfmt("raw")):
             raise ValidationError("CPF já existe em nosso banco de dados")
 
 
@@ -188,13 +178,7 @@ class edit_student_email_form(FlaskForm):
     submit = SubmitField("Confirmar")
 
     def validate_email(self, email):
-        professor = db.session.scalar(
-            sa.select(Professor).where(Professor.email == email.data)
-        )
-        student = db.session.scalar(
-            sa.select(Student).where(Student.email == email.data)
-        )
-        if (professor is not None) or (student is not None):
+        if Identity.is_taken("email", email.data):
             raise ValidationError("Email já existe em nosso banco de dados")
 
 
@@ -205,10 +189,7 @@ class edit_enrollment_inep_form(FlaskForm):
     submit = SubmitField("Confirmar")
 
     def validate_inep(self, inep):
-        school = db.session.scalar(
-            sa.select(School).where(School.inep == inep.data)
-        )
-        if school is None:
+        if inep.data not in catalogue():
             raise ValidationError("Código INEP incorreto")
 
 
@@ -0,0 +1,370 @@
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from omeg.conf.boost import db
+from omeg.conf.cache import StampedCache, TTLCache
+from omeg.data.load import payload
+from omeg.data.schools import catalogue
+from omeg.mold.models import Enrollment, History, School, Student
+
+# extracts are keyed by (taxnr, year) and dropped as soon as one of the
+# professor's enrollments is committed; the ttl only bounds how long the
+# other workers may keep showing numbers that are out of date
+extract_cache = TTLCache(ttl=60)
+medalist_cache = StampedCache("medalists")
+
+
+@sa.event.listens_for(so.Session, "after_flush")
+def collect_enrollment_changes(session, flush_context):
+    changed = session.info.setdefault("extracts", set())
+    students = session.info.setdefault("histories", set())
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(obj, Enrollment):
+            changed.add((obj.taxnr, str(obj.year)))
+            students.add(obj.cpfnr)
+
+
+@sa.event.listens_for(so.Session, "before_commit")
+def write_changed_histories(session):
+    # the histories are written within the transaction that changed the
+    # enrollments, so that both are committed or neither is
+    session.flush()
+    refresh_histories(session, session.info.pop("histories", set()))
+
+
+@sa.event.listens_for(so.Session, "after_commit")
+def forget_changed_extracts(session):
+    for key in session.info.pop("extracts", set()):
+        extract_cache.pop(key)
+
+
+@sa.event.listens_for(so.Session, "after_rollback")
+def discard_changed_extracts(session):
+    session.info.pop("extracts", None)
+    session.info.pop("histories", None)
+
+
+def refresh_histories(session, cpfnrs):
+    # sums the enrollments of each student up again; only the students
+    # whose enrollments changed are read, a few rows each, through the
+    # (cpfnr, year) index
+    cpfnrs = sorted(cpfnrs)
+    for start in range(0, len(cpfnrs), 1000):
+        batch = cpfnrs[start : start + 1000]
+        histories = {
+            history.cpfnr: history
+            for history in session.scalars(
+                sa.select(History).where(History.cpfnr.in_(batch))
+            )
+        }
+        # newest edition first; within an edition, the enrollment with the
+        # smallest (inep, taxnr) stands for the student, as in the
+        # migration that filled the table
+        latest = {}
+        for enrollment in session.execute(
+            sa.select(
+                Enrollment.cpfnr,
+                Enrollment.year,
+                Enrollment.inep,
+                Enrollment.roll,
+                Enrollment.gift,
+            )
+            .where(Enrollment.cpfnr.in_(batch))
+            .order_by(
+                Enrollment.cpfnr,
+                Enrollment.year.desc(),
+                Enrollment.inep,
+                Enrollment.taxnr,
+            )
+        ):
+            history = latest.get(enrollment.cpfnr)
+            if history is None:
+                history = latest[enrollment.cpfnr] = {
+                    "editions": 0,
+                    "medals": 0,
+                    "year": enrollment.year,
+                    "inep": enrollment.inep,
+                    "roll": enrollment.roll,
+                    "gift": enrollment.gift,
+                    "seen": None,
+                }
+            history["editions"] += history["seen"] != enrollment.year
+            history["medals"] += enrollment.gift in ["O", "P", "B"]
+            history["seen"] = enrollment.year
+        for cpfnr in batch:
+            if cpfnr not in latest:
+                if cpfnr in histories:
+                    session.delete(histories[cpfnr])
+            else:
+                latest[cpfnr].pop("seen")
+                if cpfnr in histories:
+                    for key, value in latest[cpfnr].items():
+                        setattr(histories[cpfnr], key, value)
+                else:
+                    session.add(History(cpfnr=cpfnr, **latest[cpfnr]))
+
+
+def students_extract_query(taxnr):
+    key = (taxnr, str(payload["edition"]))
+    extract = extract_cache.get(key)
+    if extract is None:
+        extract = extract_cache.set(key, students_extract(*key))
+    return extract
+
+
+def school_name(inep, schools=None):
+    # from the catalogue, or from the database while the catalogue has not
+    # caught up with a new school yet; the inep itself as a last resort
+    if schools is None:
+        schools = catalogue()
+    school = schools.get(inep)
+    if school is None:
+        school = db.session.get(School, inep)
+    return inep if school is None else school.name
+
+
+# the statements the views run on enrollments are built here, so that
+# flask data explain checks the very same ones
+
+
+def extract_of(taxnr, year):
+    # one row per (school, roll) with its head count
+    return (
+        sa.select(Enrollment.inep, Enrollment.roll, sa.func.count())
+        .where(
+            Enrollment.taxnr == taxnr,
+            Enrollment.year == year,
+        )
+        .group_by(Enrollment.inep, Enrollment.roll)
+        .order_by(Enrollment.inep)
+    )
+
+
+def students_of(taxnr, year):
+    return (
+        sa.select(Student.cpfnr, Student.fname, Student.birth, Student.email)
+        .where(
+            Enrollment.cpfnr == Student.cpfnr,
+            Enrollment.taxnr == taxnr,
+            Enrollment.year == year,
+        )
+        .order_by(Student.fname)
+    )
+
+
+def enrollments_of(taxnr, year):
+    return (
+        sa.select(
+            Student.fname,
+            Student.cpfnr,
+            Enrollment.roll,
+            Enrollment.need,
+            School.name,
+            School.inep,
+        )
+        .where(
+            Enrollment.taxnr == taxnr,
+            Student.cpfnr == Enrollment.cpfnr,
+            School.inep == Enrollment.inep,
+            Enrollment.year == year,
+        )
+        .order_by(Enrollment.roll)
+    )
+
+
+def enrollment_of(taxnr, cpfnr, year):
+    return sa.select(
+        Student.fname,
+        Enrollment.inep,
+        Enrollment.roll,
+        Enrollment.need,
+        School.name,
+    ).where(
+        Enrollment.taxnr == taxnr,
+        Enrollment.cpfnr == cpfnr,
+        Enrollment.year == year,
+        School.inep == Enrollment.inep,
+        Student.cpfnr == Enrollment.cpfnr,
+    )
+
+
+def seats_taken_of(inep, roll, year):
+    return sa.select(Enrollment.cpfnr).where(
+        Enrollment.inep == inep,
+        Enrollment.year == year,
+        Enrollment.roll == roll,
+    )
+
+
+def previous_enrollment_of(cpfnr):
+    return (
+        sa.select(Student, History)
+        .outerjoin(History, History.cpfnr == Student.cpfnr)
+        .where(Student.cpfnr == cpfnr)
+    )
+
+
+def students_extract(taxnr, year):
+    # a single round trip: one row per (school, roll) with its head count
+    rows = db.session.execute(extract_of(taxnr, year)).all()
+    schools = catalogue()
+    # extract1 = {
+    #   {
+    #     inep: {
+    #       1: qty_of_students_at_level_1,
+    #       2: qty_of_students_at_level_2,
+    #       3: qty_of_students_at_level_3
+    #     }
+    #     for each of the professor's schools
+    #   }
+    # }
+    extract1 = {}
+    # extract5 = {
+    #   inep: school_name,
+    #   for each of the professor's schools
+    # }
+    extract5 = {}
+    for inep, roll, count in rows:
+        extract1.setdefault(inep, {1: 0, 2: 0, 3: 0})[roll] = count
+        extract5[inep] = school_name(inep, schools)
+    # extract2 = {
+    #   inep: qty_of_students_in_total,
+    #   for each of the professor's schools
+    # }
+    extract2 = {inep: sum(extract1[inep].values()) for inep in extract1.keys()}
+    # extract3 = {
+    #   i: qty_of_students_at_level_i_from_all_of_the_professors_schools,
+    #   for i in [1, 2, 3]
+    # }
+    extract3 = {
+        i: sum(extract1[inep][i] for inep in extract1.keys())
+        for i in [1, 2, 3]
+    }
+    # extract4 = qty_of_students_in_total
+    extract4 = sum(v for v in extract3.values())
+    extract = {
+        1: extract1,
+        2: extract2,
+        3: extract3,
+        4: extract4,
+        5: extract5,
+    }
+    return extract
+
+
+def medalists_of(year):
+    return sa.select(Enrollment.cpfnr).where(
+        Enrollment.year == year,
+        Enrollment.gift.in_(["O", "P", "B"]),
+    )
+
+
+def medalists(year):
+    # the cpfnr of every medalist of an edition, read once per worker and
+    # kept until results are imported again
+    year = str(year)
+    cpfnrs = medalist_cache.get(year)
+    if cpfnrs is None:
+        cpfnrs = medalist_cache.set(
+            year, frozenset(db.session.scalars(medalists_of(year)))
+        )
+    return cpfnrs
+
+
+def is_medalist(cpfnr):
+    return cpfnr in medalists(payload["edition"] - 1)
+
+
+def seats_taken(inep, roll):
+    # last edition's medalists do not count against the quota; the read is
+    # a locking one so that it sees every committed enrollment, no matter
+    # when the current transaction took its snapshot
+    exempt = medalists(payload["edition"] - 1)
+    cpfnrs = db.session.scalars(
+        seats_taken_of(inep, roll, payload["edition"]).with_for_update(
+            read=True
+        )
+    )
+    return sum(cpfnr not in exempt for cpfnr in cpfnrs)
+
+
+def eligibility_of(cpfnr, inep, roll, year):
+    # whether the student is already enrolled in the edition, whether they
+    # won a medal in the previous one and how many seats of (inep, roll) are
+    # taken, all in one statement; every part is answered from an index,
+    # (cpfnr, year) for the first two and (inep, year, roll) for the count,
+    # and the medalists among the seats are looked up one by one rather
+    # than all of them being read
+    previous = so.aliased(Enrollment)
+
+    def medalist(student):
+        return sa.exists().where(
+            previous.cpfnr == student,
+            previous.year == str(int(year) - 1),
+            previous.gift.in_(["O", "P", "B"]),
+        )
+
+    enrolled = sa.exists().where(
+        Enrollment.cpfnr == cpfnr,
+        Enrollment.year == year,
+    )
+    taken = (
+        sa.select(sa.func.count())
+        .select_from(Enrollment)
+        .where(
+            Enrollment.inep == inep,
+            Enrollment.year == year,
+            Enrollment.roll == roll,
+            ~medalist(Enrollment.cpfnr),
+        )
+        .scalar_subquery()
+    )
+    return sa.select(enrolled, medalist(cpfnr), taken)
+
+
+def eligibility(cpfnr, inep, roll):
+    # (enrolled, medalist, seats taken) for the current edition
+    enrolled, medalist, taken = db.session.execute(
+        eligibility_of(cpfnr, inep, roll, str(payload["edition"]))
+    ).one()
+    return bool(enrolled), bool(medalist), taken
+
+
+def previous_enrollment(cpfnr):
+    # the student and their history, read by primary key; the history is
+    # None when the student never took part
+    return db.session.execute(previous_enrollment_of(cpfnr)).first()
+
+
+def lock_schools(ineps):
+    # locks the rows of the schools until the caller commits or rolls back,
+    # in a fixed order so that two callers cannot deadlock; callers touching
+    # the same school wait for each other, other schools are left alone.
+    # SQLite has no row locks, and pysqlite only begins a
+    # transaction on a write: there a write that changes nothing takes the
+    # lock of the whole database instead
+    ineps = sorted(ineps)
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(
+            sa.update(School.__table__)
+            .where(School.inep.in_(ineps))
+            .values(inep=School.inep)
+        )
+    else:
+        db.session.execute(
+            sa.select(School.inep)
+            .where(School.inep.in_(ineps))
+            .order_by(School.inep)
+            .with_for_update()
+        )
+
+
+def has_a_seat(inep, roll, cpfnr=None):
+    # locks the school row until the caller commits or rolls back, so that
+    # admissions into the same school are serialized while other schools
+    # are left alone; the caller must write the enrollment within the same
+    # transaction
+    lock_schools([inep])
+    if cpfnr is not None and is_medalist(cpfnr):
+        return True
+    return seats_taken(inep, roll) <= payload["quota"] - 1
@@ -1,13 +1,28 @@
+import math
 import re
 
 import sqlalchemy as sa
-from flask import Blueprint, redirect, render_template, url_for
-from flask_login import current_user, login_required
+from flask import (
+    Blueprint,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    stream_template,
+    url_for,
+)
+from flask_login import current_user
 from unidecode import unidecode
 
+from omeg.auth.identity import professor_required
 from omeg.conf.boost import db
+from omeg.conf.tokens import spend
 from omeg.data.load import CPF, DATE, payload
-from omeg.mold.models import Enrollment, Professor, School, Student
+from omeg.data.schools import catalogue
+from omeg.data.search import school_index
+from omeg.data.spatial import school_grid
+from omeg.mold.models import Enrollment, Student
+from omeg.user.bulk import COLUMNS, import_students
 from omeg.user.emails import send_enrollment_confirmation_email
 from omeg.user.forms import (
     confirm_new_enrollment_from_a_previous_one_form,
@@ -20,396 +35,315 @@ from omeg.user.forms import (
     edit_student_fname_form,
     find_enrollment_by_cpfnr,
     new_enrollment_from_a_previous_one_form,
+    student_import_form,
     student_registration_form,
 )
+from omeg.user.queries import (
+    eligibility,
+    enrollment_of,
+    enrollments_of,
+    has_a_seat,
+    previous_enrollment,
+    school_name,
+    students_extract_query,
+    students_of,
+)
 
 bp_user_routes = Blueprint("bp_user_routes", __name__)
 
 
 @bp_user_routes.route("/professor/<taxnr>/dashboard")
-@login_required
-def professor_dashboard(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        return render_template(
-            "user/dashboard.html",
-            edition=payload["edition"],
-            save_the_date=payload["save_the_date"],
-            days_until=payload["days_until"],
-            pfname=professor.fname,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def professor_dashboard(taxnr, professor):
+    return render_template(
+        "user/dashboard.html",
+        edition=payload["edition"],
+        save_the_date=payload["save_the_date"],
+        days_until=payload["days_until"],
+        pfname=professor.fname,
+    )
 
 
 @bp_user_routes.route("/professor/<taxnr>/save_the_date")
-@login_required
-def save_the_date(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        return render_template(
-            "user/utils/save_the_date.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            save_the_date=payload["save_the_date"],
-            days_until=payload["days_until"],
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def save_the_date(taxnr, professor):
+    return render_template(
+        "user/utils/save_the_date.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        save_the_date=payload["save_the_date"],
+        days_until=payload["days_until"],
+    )
 
 
 @bp_user_routes.route("/professor/<taxnr>/inep")
-@login_required
-def inep(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        schools = db.session.scalars(
-            sa.select(School).order_by(School.city)
-        ).all()
-        return render_template(
-            "user/utils/inep.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            schools=schools,
+@professor_required
+def inep(taxnr, professor):
+    city = request.args.get("city", "").strip()
+    tier = request.args.get("tier", "").strip()
+    size = 100
+    # the page is streamed: rows are sent while the catalogue is read; one
+    # school more is read to know whether there is a next page
+    return stream_template(
+        "user/utils/inep.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        city=city,
+        tier=tier,
+        size=size,
+        schools=catalogue().page(
+            after=request.args.get("after"),
+            city=city,
+            tier=tier,
+            size=size + 1,
+        ),
+    )
+
+
+@bp_user_routes.route("/professor/<taxnr>/inep/search")
+@professor_required
+def inep_search(taxnr, professor):
+    schools = school_index().search(
+        request.args.get("q", ""),
+        limit=max(1, min(request.args.get("limit", 10, type=int), 50)),
+    )
+    return jsonify(
+        [
+            {
+                "inep": school.inep,
+                "name": school.name,
+                "city": school.city,
+                "tier": school.tier,
+            }
+            for school in schools
+        ]
+    )
+
+
+@bp_user_routes.route("/professor/<taxnr>/inep/nearby")
+@professor_required
+def inep_nearby(taxnr, professor):
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    km = request.args.get("km", type=float)
+    if (
+        lat is None
+        or lon is None
+        or not (math.isfinite(lat) and -90 <= lat <= 90)
+        or not (math.isfinite(lon) and -180 <= lon <= 180)
+        or (km is not None and not (math.isfinite(km) and km >= 0))
+    ):
+        return jsonify([]), 400
+    if km is None:
+        found = school_grid().nearest(
+            lat, lon, k=max(1, min(request.args.get("k", 10, type=int), 50))
         )
     else:
-        return redirect(url_for("bp_home_routes.home"))
-
-
-def students_extract_query(taxnr):
-    # extract1 = {
-    #   {
-    #     inep: {
-    #       1: qty_of_students_at_level_1,
-    #       2: qty_of_students_at_level_2,
-    #       3: qty_of_students_at_level_3
-    #     }
-    #     for each of the professor's schools
-    #   }
-    # }
-    extract1 = {
-        inep[0]: {
-            i: db.session.query(Enrollment)
-            .where(
-                Enrollment.inep == inep[0],
-                Enrollment.taxnr == taxnr,
-                Enrollment.year == payload["edition"],
-                Enrollment.roll == i,
-            )
-            .count()
-            for i in [1, 2, 3]
-        }
-        for inep in db.session.query(Enrollment.inep)
-        .where(
-            Enrollment.taxnr == taxnr,
-            Enrollment.year == payload["edition"],
-        )
-        .all()
-    }
-    # extract2 = {
-    #   inep: qty_of_students_in_total,
-    #   for each of the professor's schools
-    # }
-    extract2 = {inep: sum(extract1[inep].values()) for inep in extract1.keys()}
-    # extract3 = {
-    #   i: qty_of_students_at_level_i_from_all_of_the_professors_schools,
-    #   for i in [1, 2, 3]
-    # }
-    extract3 = {
-        i: sum(extract1[inep][i] for inep in extract1.keys())
-        for i in [1, 2, 3]
-    }
-    # extract4 = qty_of_students_in_total
-    extract4 = sum(v for v in extract3.values())
-    # extract5 = {
-    #   inep: school_name,
-    #   for each of the professor's schools
-    # }
-    extract5 = {
-        inep: db.session.query(School.name).where(School.inep == inep).one()[0]
-        for inep in extract1.keys()
-    }
-    extract = {
-        1: extract1,
-        2: extract2,
-        3: extract3,
-        4: extract4,
-        5: extract5,
-    }
-    return extract
+        found = school_grid().within(lat, lon, min(km, 50))
+    return jsonify(
+        [
+            {
+                "inep": school.inep,
+                "name": school.name,
+                "city": school.city,
+                "km": round(distance, 3),
+            }
+            for distance, school in found
+        ]
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/registration", methods=["GET", "POST"]
 )
-@login_required
-def student_registration(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
+@professor_required
+def student_registration(taxnr, professor):
+    form = student_registration_form()
+    if form.validate_on_submit():
+        cpfnr = CPF(form.cpfnr.data).strfmt("raw")
+        student = Student(
+            cpfnr=cpfnr,
+            fname=re.sub(r"\s+", r" ", form.fname.data),
+            birth=DATE(form.birth.data).isofmt(),
+            email=form.email.data,
         )
-        form = student_registration_form()
-        if form.validate_on_submit():
-            cpfnr = CPF(form.cpfnr.data).strfmt("raw")
-            student = Student(
-                cpfnr=cpfnr,
-                fname=re.sub(r"\s+", r" ", form.fname.data),
-                birth=DATE(form.birth.data).isofmt(),
-                email=form.email.data,
-            )
-            enrollment = Enrollment(
-                cpfnr=cpfnr,
-                taxnr=taxnr,
-                inep=form.inep.data,
-                year=payload["edition"],
-                roll=form.roll.data,
-                need=re.sub(r"\s+", r" ", unidecode(form.need.data.lower())),
-                gift="N",
-            )
-            cpfnr_medalists_last_edition = [
-                enrollment.cpfnr
-                for enrollment in db.session.query(Enrollment)
-                .where(
-                    Enrollment.gift.op("REGEXP")("[OoPpBb]"),
-                    Enrollment.year == payload["edition"] - 1,
-                )
-                .all()
-            ]
-            medalists_currently_enrolled = [
-                enrollment.cpfnr
-                for enrollment in db.session.query(Enrollment)
+        enrollment = Enrollment(
+            cpfnr=cpfnr,
+            taxnr=taxnr,
+            inep=form.inep.data,
+            year=payload["edition"],
+            roll=form.roll.data,
+            need=re.sub(r"\s+", r" ", unidecode(form.need.data.lower())),
+            gift="N",
+        )
+        if has_a_seat(enrollment.inep, enrollment.roll, cpfnr):
+            enrollment_already_exists = (
+                db.session.query(Enrollment)
                 .where(
+                    Enrollment.cpfnr == enrollment.cpfnr,
+                    Enrollment.taxnr == enrollment.taxnr,
                     Enrollment.inep == enrollment.inep,
                     Enrollment.year == payload["edition"],
                 )
                 .all()
-                if enrollment.cpfnr in cpfnr_medalists_last_edition
-            ]
-            quota = len(
-                [
-                    enrollment.cpfnr
-                    for enrollment in db.session.query(Enrollment)
-                    .where(
-                        Enrollment.inep == enrollment.inep,
-                        Enrollment.year == payload["edition"],
-                        Enrollment.roll == enrollment.roll,
-                    )
-                    .all()
-                    if enrollment.cpfnr not in medalists_currently_enrolled
-                ]
             )
-            if quota <= payload["quota"] - 1:
-                enrollment_already_exists = (
-                    db.session.query(Enrollment)
-                    .where(
-                        Enrollment.cpfnr == enrollment.cpfnr,
-                        Enrollment.taxnr == enrollment.taxnr,
-                        Enrollment.inep == enrollment.inep,
-                        Enrollment.year == payload["edition"],
-                    )
-                    .all()
+            if not enrollment_already_exists:
+                db.session.add(student)
+                db.session.add(enrollment)
+            try:
+                db.session.commit()
+            except sa.exc.IntegrityError:
+                # the CPF or the email was taken in the meantime
+                db.session.rollback()
+                form.cpfnr.errors.append(
+                    "CPF ou email já existe em nosso banco de dados"
                 )
-                if not enrollment_already_exists:
-                    db.session.add(student)
-                    db.session.commit()
-                    db.session.add(enrollment)
-                    db.session.commit()
+            else:
                 return redirect(
                     url_for(
                         "bp_user_routes.registered_students",
                         taxnr=taxnr,
                     )
                 )
-            else:
-                extract = students_extract_query(professor.taxnr)
-                return render_template(
-                    "user/registration/read/quota_overflow.html",
-                    edition=payload["edition"],
-                    quota=payload["quota"],
-                    pfname=professor.fname,
-                    roll=enrollment.roll,
-                    extract=extract,
+        else:
+            db.session.rollback()
+            extract = students_extract_query(professor.taxnr)
+            return render_template(
+                "user/registration/read/quota_overflow.html",
+                edition=payload["edition"],
+                quota=payload["quota"],
+                pfname=professor.fname,
+                roll=enrollment.roll,
+                extract=extract,
+            )
+    return render_template(
+        "user/registration/create/student.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        form=form,
+    )
+
+
+@bp_user_routes.route(
+    "/professor/<taxnr>/students/import", methods=["GET", "POST"]
+)
+@professor_required
+def student_import(taxnr, professor):
+    form = student_import_form()
+    report, imported, problem = [], False, None
+    if form.validate_on_submit():
+        text = form.students.data.read().decode("utf-8-sig", "replace")
+        try:
+            report, imported = import_students(taxnr, text)
+        except ValueError as Err:
+            problem = str(Err)
+        if imported:
+            return redirect(
+                url_for(
+                    "bp_user_routes.registered_students",
+                    taxnr=taxnr,
                 )
-        return render_template(
-            "user/registration/create/student.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            form=form,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+            )
+    return render_template(
+        "user/registration/create/import.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        form=form,
+        report=report,
+        problem=problem,
+        columns=COLUMNS,
+    )
 
 
 @bp_user_routes.route("/professor/<taxnr>/students/overview")
-@login_required
-def registered_students(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        students = (
-            db.session.query(
-                Student.cpfnr,
-                Student.fname,
-                Student.birth,
-                Student.email,
-            )
-            .where(
-                Enrollment.cpfnr == Student.cpfnr,
-                Enrollment.taxnr == taxnr,
-                Enrollment.year == payload["edition"],
-            )
-            .order_by(Student.fname)
-            .all()
-        )
-        return render_template(
-            "user/registration/read/registered_students.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            students=students,
-            CPF=CPF,
-            DATE=DATE,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def registered_students(taxnr, professor):
+    students = db.session.execute(students_of(taxnr, payload["edition"])).all()
+    return render_template(
+        "user/registration/read/registered_students.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        students=students,
+        CPF=CPF,
+        DATE=DATE,
+    )
 
 
 @bp_user_routes.route("/professor/<taxnr>/enrollments/overview")
-@login_required
-def enrollments_extract(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        enrollments = (
-            db.session.query(
-                Student.fname,
-                Student.cpfnr,
-                Enrollment.roll,
-                Enrollment.need,
-                School.name,
-                School.inep,
-            )
-            .where(
-                Enrollment.taxnr == taxnr,
-                Student.cpfnr == Enrollment.cpfnr,
-                School.inep == Enrollment.inep,
-                Enrollment.year == payload["edition"],
-            )
-            .order_by(Enrollment.roll)
-            .all()
-        )
-        return render_template(
-            "user/enrollment/read/enrollments_extract.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            enrollments=enrollments,
-            CPF=CPF,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def enrollments_extract(taxnr, professor):
+    enrollments = db.session.execute(
+        enrollments_of(taxnr, payload["edition"])
+    ).all()
+    return render_template(
+        "user/enrollment/read/enrollments_extract.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        enrollments=enrollments,
+        CPF=CPF,
+    )
 
 
 @bp_user_routes.route("/professor/<taxnr>/enrollments/extract")
-@login_required
-def numeric_extract(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        extract = students_extract_query(professor.taxnr)
-        return render_template(
-            "user/enrollment/read/numeric_extract.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            extract=extract,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def numeric_extract(taxnr, professor):
+    extract = students_extract_query(professor.taxnr)
+    return render_template(
+        "user/enrollment/read/numeric_extract.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        extract=extract,
+    )
 
 
 @bp_user_routes.route("/professor/<taxnr>/student/registration/update/request")
-@login_required
-def request_student_registration_edition(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        students = (
-            db.session.query(
-                Student.cpfnr,
-                Student.fname,
-                Student.birth,
-                Student.email,
-            )
-            .where(
-                Enrollment.cpfnr == Student.cpfnr,
-                Enrollment.taxnr == taxnr,
-                Enrollment.year == payload["edition"],
-            )
-            .order_by(Student.fname)
-            .all()
-        )
-        return render_template(
-            "user/registration/update/request.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            students=students,
-            CPF=CPF,
-            DATE=DATE,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def request_student_registration_edition(taxnr, professor):
+    students = db.session.execute(students_of(taxnr, payload["edition"])).all()
+    return render_template(
+        "user/registration/update/request.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        students=students,
+        CPF=CPF,
+        DATE=DATE,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/registration/update",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_student_registration(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        student = db.first_or_404(
-            sa.select(Student).where(Student.cpfnr == cpfnr)
-        )
-        return render_template(
-            "user/registration/update/student.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            student=student,
-            CPF=CPF,
-            DATE=DATE,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def edit_student_registration(taxnr, cpfnr, professor):
+    student = db.first_or_404(sa.select(Student).where(Student.cpfnr == cpfnr))
+    return render_template(
+        "user/registration/update/student.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        student=student,
+        CPF=CPF,
+        DATE=DATE,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/registration/update/cpfnr",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_student_cpfnr(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        student = db.first_or_404(
-            sa.select(Student).where(Student.cpfnr == cpfnr)
-        )
-        form = edit_student_cpfnr_form(cpfnr=cpfnr)
-        if form.validate_on_submit():
-            student.cpfnr = CPF(form.cpfnr.data).strfmt("raw")
+@professor_required
+def edit_student_cpfnr(taxnr, cpfnr, professor):
+    student = db.first_or_404(sa.select(Student).where(Student.cpfnr == cpfnr))
+    form = edit_student_cpfnr_form(cpfnr=cpfnr)
+    if form.validate_on_submit():
+        student.cpfnr = CPF(form.cpfnr.data).strfmt("raw")
+        try:
             db.session.commit()
+        except sa.exc.IntegrityError:
+            # the CPF was taken in the meantime
+            db.session.rollback()
+            form.cpfnr.errors.append("CPF já existe em nosso banco de dados")
+        else:
             return redirect(
                 url_for(
                     "bp_user_routes.edit_student_registration",
@@ -417,107 +351,91 @@ def edit_student_cpfnr(taxnr, cpfnr):
                     cpfnr=student.cpfnr,
                 )
             )
-        return render_template(
-            "user/registration/update/field/cpfnr.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=student.fname,
-            cpfnr=cpfnr,
-            form=form,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/registration/update/field/cpfnr.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=student.fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/registration/update/fname",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_student_fname(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        student = db.first_or_404(
-            sa.select(Student).where(Student.cpfnr == cpfnr)
-        )
-        form = edit_student_fname_form(fname=student.fname)
-        if form.validate_on_submit():
-            student.fname = re.sub(r"\s+", r" ", form.fname.data)
-            db.session.commit()
-            return redirect(
-                url_for(
-                    "bp_user_routes.edit_student_registration",
-                    taxnr=taxnr,
-                    cpfnr=cpfnr,
-                )
+@professor_required
+def edit_student_fname(taxnr, cpfnr, professor):
+    student = db.first_or_404(sa.select(Student).where(Student.cpfnr == cpfnr))
+    form = edit_student_fname_form(fname=student.fname)
+    if form.validate_on_submit():
+        student.fname = re.sub(r"\s+", r" ", form.fname.data)
+        db.session.commit()
+        return redirect(
+            url_for(
+                "bp_user_routes.edit_student_registration",
+                taxnr=taxnr,
+                cpfnr=cpfnr,
             )
-        return render_template(
-            "user/registration/update/field/fname.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=student.fname,
-            cpfnr=cpfnr,
-            form=form,
         )
-    return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/registration/update/field/fname.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=student.fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/registration/update/birth",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_student_birth(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        student = db.first_or_404(
-            sa.select(Student).where(Student.cpfnr == cpfnr)
-        )
-        form = edit_student_birth_form(
-            birth=DATE(student.birth).strfmt("dd-mm-yyyy")
-        )
-        if form.validate_on_submit():
-            student.birth = DATE(form.birth.data).isofmt()
-            db.session.commit()
-            return redirect(
-                url_for(
-                    "bp_user_routes.edit_student_registration",
-                    taxnr=taxnr,
-                    cpfnr=cpfnr,
-                )
+@professor_required
+def edit_student_birth(taxnr, cpfnr, professor):
+    student = db.first_or_404(sa.select(Student).where(Student.cpfnr == cpfnr))
+    form = edit_student_birth_form(
+        birth=DATE(student.birth).strfmt("dd-mm-yyyy")
+    )
+    if form.validate_on_submit():
+        student.birth = DATE(form.birth.data).isofmt()
+        db.session.commit()
+        return redirect(
+            url_for(
+                "bp_user_routes.edit_student_registration",
+                taxnr=taxnr,
+                cpfnr=cpfnr,
             )
-        return render_template(
-            "user/registration/update/field/birth.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=student.fname,
-            cpfnr=cpfnr,
-            form=form,
         )
-    return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/registration/update/field/birth.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=student.fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/registration/update/email",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_student_email(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        student = db.first_or_404(
-            sa.select(Student).where(Student.cpfnr == cpfnr)
-        )
-        form = edit_student_email_form(email=student.email)
-        if form.validate_on_submit():
-            student.email = form.email.data
+@professor_required
+def edit_student_email(taxnr, cpfnr, professor):
+    student = db.first_or_404(sa.select(Student).where(Student.cpfnr == cpfnr))
+    form = edit_student_email_form(email=student.email)
+    if form.validate_on_submit():
+        student.email = form.email.data
+        try:
             db.session.commit()
+        except sa.exc.IntegrityError:
+            # the email was taken in the meantime
+            db.session.rollback()
+            form.email.errors.append("Email já existe em nosso banco de dados")
+        else:
             return redirect(
                 url_for(
                     "bp_user_routes.edit_student_registration",
@@ -525,360 +443,250 @@ def edit_student_email(taxnr, cpfnr):
                     cpfnr=cpfnr,
                 )
             )
-        return render_template(
-            "user/registration/update/field/email.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=student.fname,
-            cpfnr=cpfnr,
-            form=form,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/registration/update/field/email.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=student.fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route("/professor/<taxnr>/student/enrollment/update/request")
-@login_required
-def request_student_enrollment_edition(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        enrollments = (
-            db.session.query(
-                Student.fname,
-                Student.cpfnr,
-                Enrollment.roll,
-                Enrollment.need,
-                School.name,
-                School.inep,
-            )
-            .where(
-                Enrollment.taxnr == taxnr,
-                Enrollment.year == payload["edition"],
-                Student.cpfnr == Enrollment.cpfnr,
-                School.inep == Enrollment.inep,
-            )
-            .order_by(Enrollment.roll)
-            .all()
-        )
-        return render_template(
-            "user/enrollment/update/request.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            enrollments=enrollments,
-            CPF=CPF,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def request_student_enrollment_edition(taxnr, professor):
+    enrollments = db.session.execute(
+        enrollments_of(taxnr, payload["edition"])
+    ).all()
+    return render_template(
+        "user/enrollment/update/request.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        enrollments=enrollments,
+        CPF=CPF,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/enrollment/update",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_student_enrollment(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        enrollment = (
-            db.session.query(
-                Student.fname,
-                Enrollment.inep,
-                Enrollment.roll,
-                Enrollment.need,
-                School.name,
-            )
-            .where(
-                Enrollment.taxnr == taxnr,
-                Enrollment.cpfnr == cpfnr,
-                Enrollment.year == payload["edition"],
-                School.inep == Enrollment.inep,
-                Student.cpfnr == Enrollment.cpfnr,
-            )
-            .first()
-        )
-        return render_template(
-            "user/enrollment/update/enrollment.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            cpfnr=cpfnr,
-            enrollment=enrollment,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def edit_student_enrollment(taxnr, cpfnr, professor):
+    enrollment = db.session.execute(
+        enrollment_of(taxnr, cpfnr, payload["edition"])
+    ).first()
+    return render_template(
+        "user/enrollment/update/enrollment.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        cpfnr=cpfnr,
+        enrollment=enrollment,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/enrollment/update/inep",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_enrollment_inep(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
+@professor_required
+def edit_enrollment_inep(taxnr, cpfnr, professor):
+    students_enrollment = (
+        db.session.query(
+            Student.fname,
+            Enrollment.inep,
+            Enrollment.roll,
         )
-        students_enrollment = (
-            db.session.query(
-                Student.fname,
-                Enrollment.inep,
-                Enrollment.roll,
-            )
+        .where(
+            Enrollment.cpfnr == cpfnr,
+            Enrollment.taxnr == taxnr,
+            Enrollment.year == payload["edition"],
+            Student.cpfnr == Enrollment.cpfnr,
+        )
+        .first()
+    )
+    form = edit_enrollment_inep_form(inep=students_enrollment.inep)
+    if form.validate_on_submit():
+        enrollment = (
+            db.session.query(Enrollment)
             .where(
                 Enrollment.cpfnr == cpfnr,
                 Enrollment.taxnr == taxnr,
                 Enrollment.year == payload["edition"],
-                Student.cpfnr == Enrollment.cpfnr,
             )
             .first()
         )
-        form = edit_enrollment_inep_form(inep=students_enrollment.inep)
-        if form.validate_on_submit():
-            enrollment = (
-                db.session.query(Enrollment)
-                .where(
-                    Enrollment.cpfnr == cpfnr,
-                    Enrollment.taxnr == taxnr,
-                    Enrollment.year == payload["edition"],
-                )
-                .first()
-            )
-            quota = (
-                db.session.query(Enrollment)
-                .where(
-                    Enrollment.inep == form.inep.data,
-                    Enrollment.year == payload["edition"],
-                    Enrollment.roll == students_enrollment.roll,
-                )
-                .count()
-            )
-            if quota <= payload["quota"] - 1:
-                enrollment.inep = form.inep.data
-                db.session.commit()
-            return redirect(
-                url_for(
-                    "bp_user_routes.edit_student_enrollment",
-                    taxnr=taxnr,
-                    cpfnr=cpfnr,
-                )
+        if has_a_seat(form.inep.data, students_enrollment.roll, cpfnr):
+            enrollment.inep = form.inep.data
+            db.session.commit()
+        else:
+            db.session.rollback()
+        return redirect(
+            url_for(
+                "bp_user_routes.edit_student_enrollment",
+                taxnr=taxnr,
+                cpfnr=cpfnr,
             )
-        return render_template(
-            "user/enrollment/update/field/inep.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=students_enrollment.fname,
-            cpfnr=cpfnr,
-            form=form,
         )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/enrollment/update/field/inep.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=students_enrollment.fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/enrollment/update/roll",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_enrollment_roll(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
+@professor_required
+def edit_enrollment_roll(taxnr, cpfnr, professor):
+    students_enrollment = (
+        db.session.query(
+            Student.fname,
+            Enrollment.roll,
         )
-        students_enrollment = (
-            db.session.query(
-                Student.fname,
-                Enrollment.roll,
-            )
+        .where(
+            Enrollment.cpfnr == cpfnr,
+            Enrollment.taxnr == taxnr,
+            Enrollment.year == payload["edition"],
+            Student.cpfnr == Enrollment.cpfnr,
+        )
+        .first()
+    )
+    form = edit_enrollment_roll_form(roll=students_enrollment.roll)
+    if form.validate_on_submit():
+        enrollment = (
+            db.session.query(Enrollment)
             .where(
                 Enrollment.cpfnr == cpfnr,
                 Enrollment.taxnr == taxnr,
                 Enrollment.year == payload["edition"],
-                Student.cpfnr == Enrollment.cpfnr,
             )
             .first()
         )
-        form = edit_enrollment_roll_form(roll=students_enrollment.roll)
-        if form.validate_on_submit():
-            enrollment = (
-                db.session.query(Enrollment)
-                .where(
-                    Enrollment.cpfnr == cpfnr,
-                    Enrollment.taxnr == taxnr,
-                    Enrollment.year == payload["edition"],
-                )
-                .first()
-            )
-            quota = (
-                db.session.query(Enrollment)
-                .where(
-                    Enrollment.inep == enrollment.inep,
-                    Enrollment.year == payload["edition"],
-                    Enrollment.roll == form.roll.data,
-                )
-                .count()
-            )
-            if quota <= payload["quota"] - 1:
-                enrollment.roll = form.roll.data
-                db.session.commit()
-            return redirect(
-                url_for(
-                    "bp_user_routes.edit_student_enrollment",
-                    taxnr=taxnr,
-                    cpfnr=cpfnr,
-                )
+        if has_a_seat(enrollment.inep, form.roll.data, cpfnr):
+            enrollment.roll = form.roll.data
+            db.session.commit()
+        else:
+            db.session.rollback()
+        return redirect(
+            url_for(
+                "bp_user_routes.edit_student_enrollment",
+                taxnr=taxnr,
+                cpfnr=cpfnr,
             )
-        return render_template(
-            "user/enrollment/update/field/roll.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=students_enrollment.fname,
-            cpfnr=cpfnr,
-            form=form,
         )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/enrollment/update/field/roll.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=students_enrollment.fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/student/<cpfnr>/enrollment/update/need",
     methods=["GET", "POST"],
 )
-@login_required
-def edit_enrollment_need(taxnr, cpfnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
+@professor_required
+def edit_enrollment_need(taxnr, cpfnr, professor):
+    students_enrollment = (
+        db.session.query(
+            Student.fname,
+            Enrollment.need,
         )
-        students_enrollment = (
-            db.session.query(
-                Student.fname,
-                Enrollment.need,
-            )
+        .where(
+            Enrollment.cpfnr == cpfnr,
+            Enrollment.taxnr == taxnr,
+            Enrollment.year == payload["edition"],
+            Student.cpfnr == Enrollment.cpfnr,
+        )
+        .first()
+    )
+    form = edit_enrollment_need_form(need=students_enrollment.need)
+    if form.validate_on_submit():
+        enrollment = (
+            db.session.query(Enrollment)
             .where(
                 Enrollment.cpfnr == cpfnr,
                 Enrollment.taxnr == taxnr,
                 Enrollment.year == payload["edition"],
-                Student.cpfnr == Enrollment.cpfnr,
             )
             .first()
         )
-        form = edit_enrollment_need_form(need=students_enrollment.need)
-        if form.validate_on_submit():
-            enrollment = (
-                db.session.query(Enrollment)
-                .where(
-                    Enrollment.cpfnr == cpfnr,
-                    Enrollment.taxnr == taxnr,
-                    Enrollment.year == payload["edition"],
-                )
-                .first()
-            )
-            enrollment.need = re.sub(
-                r"\s+", r" ", unidecode(form.need.data.lower())
-            )
-            db.session.commit()
-            return redirect(
-                url_for(
-                    "bp_user_routes.edit_student_enrollment",
-                    taxnr=taxnr,
-                    cpfnr=cpfnr,
-                )
+        enrollment.need = re.sub(
+            r"\s+", r" ", unidecode(form.need.data.lower())
+        )
+        db.session.commit()
+        return redirect(
+            url_for(
+                "bp_user_routes.edit_student_enrollment",
+                taxnr=taxnr,
+                cpfnr=cpfnr,
             )
-        return render_template(
-            "user/enrollment/update/field/need.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=students_enrollment.fname,
-            cpfnr=cpfnr,
-            form=form,
         )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/enrollment/update/field/need.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=students_enrollment.fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
     "/professor/<taxnr>/enrollments/past-seven-years", methods=["GET", "POST"]
 )
-@login_required
-def find_enrollment_by_student_cpfnr(taxnr):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        form = find_enrollment_by_cpfnr()
-        if form.validate_on_submit():
-            student = (
-                db.session.query(Student)
-                .where(Student.cpfnr == CPF(form.cpfnr.data).strfmt("raw"))
-                .first()
-            )
-            if student is None:
-                return redirect(
-                    url_for("bp_user_routes.student_registration", taxnr=taxnr)
-                )
-            if student is not None:
-                currently_enrolled = (
-                    db.session.query(Enrollment)
-                    .where(
-                        Enrollment.cpfnr == CPF(form.cpfnr.data).strfmt("raw"),
-                        Enrollment.year == payload["edition"],
-                    )
-                    .first()
-                )
-                if currently_enrolled is None:
-                    enrollment = (
-                        db.session.query(
-                            Student.cpfnr,
-                            Student.fname,
-                            Student.birth,
-                            Student.email,
-                            School.inep,
-                            School.name,
-                            Enrollment.year,
-                            Enrollment.roll,
-                        )
-                        .where(
-                            Student.cpfnr == Enrollment.cpfnr,
-                            School.inep == Enrollment.inep,
-                            Enrollment.cpfnr
-                            == (CPF(form.cpfnr.data).strfmt("raw")),
-                            Enrollment.year >= payload["edition"] - 7,
-                            Enrollment.year <= payload["edition"] - 1,
-                        )
-                        .order_by(Enrollment.year.desc())
-                        .first()
-                    )
-                    form = new_enrollment_from_a_previous_one_form(
-                        confirmation="Sim"
-                    )
-                    return render_template(
-                        "user/enrollment/create/confirm.html",
-                        edition=payload["edition"],
-                        taxnr=taxnr,
-                        pfname=professor.fname,
-                        cpfnr=enrollment.cpfnr,
-                        fname=enrollment.fname,
-                        birth=enrollment.birth,
-                        email=enrollment.email,
-                        inep=enrollment.inep,
-                        name=enrollment.name,
-                        year=enrollment.year,
-                        roll=enrollment.roll,
-                        CPF=CPF,
-                        DATE=DATE,
-                        form=form,
-                    )
-        return render_template(
-            "user/enrollment/read/past_seven_years.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            form=form,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+@professor_required
+def find_enrollment_by_student_cpfnr(taxnr, professor):
+    form = find_enrollment_by_cpfnr()
+    if form.validate_on_submit():
+        found = previous_enrollment(CPF(form.cpfnr.data).strfmt("raw"))
+        if found is None:
+            return redirect(
+                url_for("bp_user_routes.student_registration", taxnr=taxnr)
+            )
+        student, history = found
+        # the latest edition of the student, if it is one of the past seven;
+        # a student enrolled in the current edition is not enrolled again
+        if (
+            history is not None
+            and payload["edition"] - 7
+            <= int(history.year)
+            <= payload["edition"] - 1
+        ):
+            form = new_enrollment_from_a_previous_one_form(confirmation="Sim")
+            return render_template(
+                "user/enrollment/create/confirm.html",
+                edition=payload["edition"],
+                taxnr=taxnr,
+                pfname=professor.fname,
+                cpfnr=student.cpfnr,
+                fname=student.fname,
+                birth=student.birth,
+                email=student.email,
+                inep=history.inep,
+                name=school_name(history.inep),
+                year=history.year,
+                roll=history.roll,
+                CPF=CPF,
+                DATE=DATE,
+                form=form,
+            )
+    return render_template(
+        "user/enrollment/read/past_seven_years.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
@@ -886,93 +694,58 @@ def find_enrollment_by_student_cpfnr(taxnr):
     "/<cpfnr>/<fname>/<birth>/<email>/<inep>/<name>/<year>/<roll>",
     methods=["GET", "POST"],
 )
-@login_required
+@professor_required
 def new_enrollment_from_previous_one(
-    taxnr, cpfnr, fname, birth, email, inep, name, year, roll
+    taxnr, cpfnr, fname, birth, email, inep, name, year, roll, professor
 ):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        form = new_enrollment_from_a_previous_one_form(confirmation="Sim")
-        if form.validate_on_submit():
-            currently_enrolled = [
-                enrollment.cpfnr
-                for enrollment in db.session.query(Enrollment)
-                .where(
-                    Enrollment.year == payload["edition"],
-                )
-                .all()
-            ]
-            medalists_last_edition = [
-                enrollment.cpfnr
-                for enrollment in db.session.query(Enrollment)
-                .where(
-                    Enrollment.gift.op("REGEXP")("[OoPpBb]"),
-                    Enrollment.year == payload["edition"] - 1,
-                )
-                .all()
-            ]
-            quota = len(
-                [
-                    enrollment.cpfnr
-                    for enrollment in db.session.query(Enrollment)
-                    .where(
-                        Enrollment.inep == inep,
-                        Enrollment.year == payload["edition"],
-                        Enrollment.roll == roll,
-                    )
-                    .all()
-                    if enrollment.cpfnr not in medalists_last_edition
-                ]
+    form = new_enrollment_from_a_previous_one_form(confirmation="Sim")
+    if form.validate_on_submit():
+        # the seat is only taken when the student confirms the
+        # enrollment, see enroll_student
+        enrolled, medalist, taken = eligibility(cpfnr, inep, roll)
+        if not enrolled and (medalist or taken <= payload["quota"] - 1):
+            send_enrollment_confirmation_email(
+                taxnr=taxnr,
+                pfname=professor.fname,
+                cpfnr=cpfnr,
+                sfname=fname,
+                birth=birth,
+                semail=email,
+                inep=inep,
+                name=name,
+                roll=roll,
             )
-            cond1 = cpfnr not in currently_enrolled
-            cond2 = cpfnr in medalists_last_edition
-            cond3 = quota <= payload["quota"] - 1
-            if cond1 and (cond2 or cond3):
-                send_enrollment_confirmation_email(
+            db.session.commit()
+            return redirect(
+                url_for(
+                    "bp_user_routes.enrollments_extract",
                     taxnr=taxnr,
-                    pfname=professor.fname,
-                    cpfnr=cpfnr,
-                    sfname=fname,
-                    birth=birth,
-                    semail=email,
-                    inep=inep,
-                    name=name,
-                    roll=roll,
-                )
-                return redirect(
-                    url_for(
-                        "bp_user_routes.enrollments_extract",
-                        taxnr=taxnr,
-                    )
                 )
-            else:
-                return redirect(
-                    url_for(
-                        "bp_user_routes.enrollments_extract",
-                        taxnr=taxnr,
-                    )
+            )
+        else:
+            return redirect(
+                url_for(
+                    "bp_user_routes.enrollments_extract",
+                    taxnr=taxnr,
                 )
-        return render_template(
-            "user/enrollment/create/confirm.html",
-            edition=payload["edition"],
-            taxnr=taxnr,
-            pfname=professor.fname,
-            cpfnr=cpfnr,
-            fname=fname,
-            birth=birth,
-            email=email,
-            inep=inep,
-            name=name,
-            year=year,
-            roll=roll,
-            CPF=CPF,
-            DATE=DATE,
-            form=form,
-        )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+            )
+    return render_template(
+        "user/enrollment/create/confirm.html",
+        edition=payload["edition"],
+        taxnr=taxnr,
+        pfname=professor.fname,
+        cpfnr=cpfnr,
+        fname=fname,
+        birth=birth,
+        email=email,
+        inep=inep,
+        name=name,
+        year=year,
+        roll=roll,
+        CPF=CPF,
+        DATE=DATE,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
@@ -981,45 +754,35 @@ def new_enrollment_from_previous_one(
     "/edit-inep",
     methods=["GET", "POST"],
 )
-@login_required
+@professor_required
 def edit_inep_for_new_enrollment(
-    taxnr, cpfnr, fname, birth, email, inep, name, year, roll
+    taxnr, cpfnr, fname, birth, email, inep, name, year, roll, professor
 ):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        form = edit_enrollment_inep_form(inep=inep)
-        if form.validate_on_submit():
-            school = (
-                db.session.query(School)
-                .where(School.inep == form.inep.data)
-                .first()
-            )
-            return redirect(
-                url_for(
-                    "bp_user_routes.new_enrollment_from_previous_one",
-                    taxnr=taxnr,
-                    cpfnr=cpfnr,
-                    fname=fname,
-                    birth=birth,
-                    email=email,
-                    inep=school.inep,
-                    name=school.name,
-                    year=year,
-                    roll=roll,
-                )
+    form = edit_enrollment_inep_form(inep=inep)
+    if form.validate_on_submit():
+        school = catalogue().get(form.inep.data)
+        return redirect(
+            url_for(
+                "bp_user_routes.new_enrollment_from_previous_one",
+                taxnr=taxnr,
+                cpfnr=cpfnr,
+                fname=fname,
+                birth=birth,
+                email=email,
+                inep=school.inep,
+                name=school.name,
+                year=year,
+                roll=roll,
             )
-        return render_template(
-            "user/enrollment/update/field/inep.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=fname,
-            cpfnr=cpfnr,
-            form=form,
         )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/enrollment/update/field/inep.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route(
@@ -1028,40 +791,34 @@ def edit_inep_for_new_enrollment(
     "/edit-roll",
     methods=["GET", "POST"],
 )
-@login_required
+@professor_required
 def edit_roll_for_new_enrollment(
-    taxnr, cpfnr, fname, birth, email, inep, name, year, roll
+    taxnr, cpfnr, fname, birth, email, inep, name, year, roll, professor
 ):
-    if taxnr == current_user.taxnr:
-        professor = db.first_or_404(
-            sa.select(Professor).where(Professor.taxnr == taxnr)
-        )
-        form = edit_enrollment_roll_form(roll=roll)
-        if form.validate_on_submit():
-            return redirect(
-                url_for(
-                    "bp_user_routes.new_enrollment_from_previous_one",
-                    taxnr=taxnr,
-                    cpfnr=cpfnr,
-                    fname=fname,
-                    birth=birth,
-                    email=email,
-                    inep=inep,
-                    name=name,
-                    year=year,
-                    roll=form.roll.data,
-                )
+    form = edit_enrollment_roll_form(roll=roll)
+    if form.validate_on_submit():
+        return redirect(
+            url_for(
+                "bp_user_routes.new_enrollment_from_previous_one",
+                taxnr=taxnr,
+                cpfnr=cpfnr,
+                fname=fname,
+                birth=birth,
+                email=email,
+                inep=inep,
+                name=name,
+                year=year,
+                roll=form.roll.data,
             )
-        return render_template(
-            "user/enrollment/update/field/roll.html",
-            edition=payload["edition"],
-            pfname=professor.fname,
-            sfname=fname,
-            cpfnr=cpfnr,
-            form=form,
         )
-    else:
-        return redirect(url_for("bp_home_routes.home"))
+    return render_template(
+        "user/enrollment/update/field/roll.html",
+        edition=payload["edition"],
+        pfname=professor.fname,
+        sfname=fname,
+        cpfnr=cpfnr,
+        form=form,
+    )
 
 
 @bp_user_routes.route("/student/enroll/<token>", methods=["GET", "POST"])
@@ -1074,6 +831,8 @@ def enroll_student(token):
         )
     else:
         decoded = Enrollment.verify_enrollment_request_token(token)
+        if not decoded:
+            return redirect(url_for("bp_home_routes.home"))
         form = confirm_new_enrollment_from_a_previous_one_form(
             confirmation="Sim"
         )
@@ -1094,11 +853,22 @@ def enroll_student(token):
                 roll=roll,
             )
             if form.validate_on_submit():
-                db.session.add(enrollment)
-                db.session.commit()
-                return render_template(
-                    "user/enrollment/create/congrats.html",
-                    edition=payload["edition"],
+                if has_a_seat(inep, roll, cpfnr):
+                    db.session.add(enrollment)
+                    spend(token)
+                    try:
+                        db.session.commit()
+                    except sa.exc.IntegrityError:
+                        # the token was used by another request meanwhile
+                        db.session.rollback()
+                        return redirect(url_for("bp_home_routes.home"))
+                    return render_template(
+                        "user/enrollment/create/congrats.html",
+                        edition=payload["edition"],
+                    )
+                db.session.rollback()
+                form.confirmation.errors.append(
+                    "Não há mais vagas para este nível nesta escola"
                 )
         return render_template(
             "user/enrollment/create/enroll.html",